@@ -0,0 +1,90 @@
+"""
+Server-managed download archives shared by all jobs
+Each archive is an in-memory set backed by a durable append log in the same
+format as yt-dlp's --download-archive file
+"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from yt_dlp.extractor import gen_extractor_classes
+from yt_dlp.utils import make_archive_id
+
+logger = logging.getLogger(__name__)
+
+
+def url_archive_id(url: str) -> Optional[str]:
+    """Archive ID for a URL without extracting it, None if the extractor can't tell"""
+    for ie in gen_extractor_classes():
+        if ie.suitable(url):
+            temp_id = ie.get_temp_id(url)
+            return make_archive_id(ie.ie_key(), temp_id) if temp_id else None
+    return None
+
+
+class DownloadArchive:
+    """Set-like archive that yt-dlp accepts directly as its download_archive param"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ids = set()
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                self.ids = {line.strip() for line in f if line.strip()}
+        self.log = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, vid_id):
+        return vid_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, vid_id: str):
+        with self.lock:
+            if vid_id in self.ids:
+                return
+            self.log.write(vid_id + '\n')
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.ids.add(vid_id)
+
+    def filter_urls(self, urls: List[str]) -> List[str]:
+        """Drop URLs that are already recorded, before they are ever scheduled"""
+        return [url for url in urls if url_archive_id(url) not in self.ids]
+
+
+class ArchiveRegistry:
+    """One shared DownloadArchive per archive file"""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self.lock = threading.Lock()
+        self.archives: Dict[Path, DownloadArchive] = {}
+
+    def get(self, name: str) -> DownloadArchive:
+        # Relative archive names live next to the rest of the server state
+        path = (self.base_dir / name).resolve()
+        with self.lock:
+            if path not in self.archives:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self.archives[path] = DownloadArchive(path)
+                logger.info(f"Loaded download archive {path} ({len(self.archives[path])} entries)")
+            return self.archives[path]
+
+    def for_options(self, ydl_opts: Dict[str, Any]) -> Optional[DownloadArchive]:
+        """Swap a download_archive file option for the shared in-memory archive"""
+        name = ydl_opts.get('download_archive')
+        if not name:
+            return None
+        if isinstance(name, DownloadArchive):
+            return name
+        archive = self.get(str(name))
+        ydl_opts['download_archive'] = archive
+        return archive
+
+    def list_archives(self) -> List[Dict[str, Any]]:
+        return [{'path': str(path), 'entries': len(archive)} for path, archive in self.archives.items()]
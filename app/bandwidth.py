@@ -0,0 +1,185 @@
+"""
+Server-wide bandwidth sharing
+All download workers draw from one budget (BANDWIDTH_LIMIT, bytes/s as in
+yt-dlp's --limit-rate). Each running job gets a token bucket whose rate is
+its weighted share of the budget. Shares are rebalanced as jobs start and
+finish, and jobs that cannot use their share (a slow source) hand the
+remainder to the others
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Any
+
+from yt_dlp.utils import parse_bytes
+
+from .metrics import registry, Counter, Gauge
+
+DEFAULT_WEIGHTS = {'interactive': 4, 'batch': 1, 'subscription': 1}
+REBALANCE_INTERVAL = 1.0  # seconds between demand-based rebalances
+BURST_SECONDS = 0.5  # a bucket holds at most this much of its rate
+LIMITED_RATIO = 0.8  # a job using less than this share of its rate is limited by its source
+PROBE_FACTOR = 1.5  # headroom for limited jobs to ramp back up, keeps them below LIMITED_RATIO
+THROTTLED_RATIO = 0.1  # a job that waited this share of the window wanted more than it got
+SMOOTHING = 0.5  # weight of the latest window in the measured throughput
+READ_SIZE = 64 * 1024  # fixed HTTP read size while limited, yt-dlp otherwise grows reads to 4 MiB
+
+THROTTLE_SECONDS = registry.register(Counter(
+    'ytdlp_co2_bandwidth_throttle_seconds_total', 'Time download threads waited for bandwidth', ('job_class',)))
+
+
+def parse_weights(spec: str, defaults: Dict[str, float] = None) -> Dict[str, float]:
+    """'interactive=4,batch=1' -> {'interactive': 4.0, 'batch': 1.0}, on top of defaults"""
+    weights = dict(DEFAULT_WEIGHTS if defaults is None else defaults)
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, weight = item.partition('=')
+        try:
+            weights[name.strip()] = max(0.01, float(weight))
+        except ValueError:
+            continue
+    return weights
+
+
+class BandwidthManager:
+    def __init__(self, limit: int = 0, weights: Dict[str, float] = None):
+        self.limit = limit
+        self.weights = weights or dict(DEFAULT_WEIGHTS)
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.last_rebalance = 0.0
+
+    def set_limit(self, limit: int):
+        with self.lock:
+            self.limit = limit
+            self.rebalance()
+
+    def register(self, job_id: str, job_class: str):
+        now = time.monotonic()
+        with self.lock:
+            self.jobs[job_id] = {
+                'job_class': job_class,
+                'weight': self.weights.get(job_class, 1),
+                'rate': 0.0,
+                'tokens': 0.0,
+                'updated': now,
+                'window_start': now,
+                'window_bytes': 0,
+                'measured': None,
+                'waited': 0.0,
+                'limited': False,
+            }
+            self.rebalance()
+
+    def set_class(self, job_id: str, job_class: str):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['job_class'], job['weight'] = job_class, self.weights.get(job_class, 1)
+                self.rebalance()
+
+    def unregister(self, job_id: str):
+        with self.lock:
+            if self.jobs.pop(job_id, None) is not None:
+                self.rebalance()
+
+    def rebalance(self):
+        """Weighted max-min fair split of the limit, called with the lock held"""
+        now = time.monotonic()
+        self.last_rebalance = now
+        demands = {}
+        for job_id, job in self.jobs.items():
+            elapsed = now - job['window_start']
+            if elapsed >= REBALANCE_INTERVAL:
+                throughput = job['window_bytes'] / elapsed
+                job['measured'] = throughput if job['measured'] is None else (
+                    SMOOTHING * throughput + (1 - SMOOTHING) * job['measured'])
+                # A job that kept waiting on its bucket is held back by us, not by its source
+                throttled = job['waited'] >= elapsed * THROTTLED_RATIO
+                job['limited'] = not throttled and job['measured'] < job['rate'] * LIMITED_RATIO
+                job['window_start'], job['window_bytes'], job['waited'] = now, 0, 0.0
+            demands[job_id] = job['measured'] * PROBE_FACTOR if job['limited'] else float('inf')
+
+        # Water-filling: satisfy jobs that need less than their share, split the rest by weight
+        remaining = float(self.limit)
+        unresolved = set(self.jobs)
+        while unresolved:
+            total_weight = sum(self.jobs[job_id]['weight'] for job_id in unresolved)
+            capped = [job_id for job_id in unresolved
+                      if demands[job_id] <= remaining * self.jobs[job_id]['weight'] / total_weight]
+            if not capped:
+                for job_id in unresolved:
+                    self.jobs[job_id]['rate'] = remaining * self.jobs[job_id]['weight'] / total_weight
+                break
+            for job_id in capped:
+                self.jobs[job_id]['rate'] = demands[job_id]
+                remaining -= demands[job_id]
+                unresolved.discard(job_id)
+
+    def refill(self, job: Dict[str, Any], now: float):
+        rate = max(job['rate'], 1.0)
+        job['tokens'] = min(rate * BURST_SECONDS, job['tokens'] + (now - job['updated']) * rate)
+        job['updated'] = now
+
+    def consume(self, job_id: str, amount: int):
+        """Take amount bytes from the job's bucket, sleeping the calling download thread while it is in debt"""
+        if not self.limit or amount <= 0:
+            return
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            self.refill(job, time.monotonic())
+            job['tokens'] -= amount
+            job['window_bytes'] += amount
+        # Sleep in short slices so a rebalance or unregister during the wait takes effect
+        while True:
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None or not self.limit:
+                    return
+                now = time.monotonic()
+                if now - self.last_rebalance >= REBALANCE_INTERVAL:
+                    self.rebalance()
+                self.refill(job, now)
+                if job['tokens'] >= 0:
+                    return
+                wait = min(-job['tokens'] / max(job['rate'], 1.0), REBALANCE_INTERVAL)
+                job['waited'] += wait
+                job_class = job['job_class']
+            THROTTLE_SECONDS.inc(wait, job_class=job_class)
+            time.sleep(wait)
+
+    def download_params(self) -> Dict[str, Any]:
+        """YoutubeDL params that keep a limited download's reads small enough to pace smoothly"""
+        if not self.limit:
+            return {}
+        return {'buffersize': READ_SIZE, 'noresizebuffer': True}
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'weights': self.weights,
+                'jobs': {job_id: {'job_class': job['job_class'], 'rate': job['rate'], 'measured': job['measured']}
+                         for job_id, job in self.jobs.items()},
+            }
+
+    def class_rates(self) -> Dict[tuple, float]:
+        with self.lock:
+            rates = {}
+            for job in self.jobs.values():
+                rates[(job['job_class'],)] = rates.get((job['job_class'],), 0) + job['rate']
+            return rates
+
+
+def configured_limit() -> int:
+    return parse_bytes(os.environ.get('BANDWIDTH_LIMIT', '') or '0') or 0
+
+
+bandwidth = BandwidthManager(configured_limit(), parse_weights(os.environ.get('BANDWIDTH_WEIGHTS', '')))
+
+registry.register(Gauge('ytdlp_co2_bandwidth_limit_bytes', 'Server-wide download bandwidth budget, 0 for unlimited',
+                        function=lambda: bandwidth.limit))
+registry.register(Gauge('ytdlp_co2_bandwidth_allocated_bytes', 'Bandwidth currently allocated to each job class',
+                        ('job_class',), function=bandwidth.class_rates))
@@ -0,0 +1,410 @@
+"""
+Adaptive download concurrency
+Downloads wait for a slot before they start transferring. Every few seconds
+a controller looks at aggregate throughput, the failure rate and time to
+first byte, and resizes the slot pool additive-increase/multiplicative-
+decrease: one more slot while jobs are queued and the last step paid off,
+half as many as soon as sources fail, slow down or throughput drops.
+Waiting downloads queue in priority lanes by job class. A freed slot goes to
+the highest lane with work (strict) or to the lane furthest behind its
+weighted share (weighted), and interactive jobs may use a few slots above
+the limit so a pasted link starts even while bulk jobs fill the pool.
+Within a lane, slots are shared between submitters (API key, client ID or
+IP) by weighted fair queuing, optionally capped per submitter. A submitter's
+own jobs go smallest size bucket first, using the size estimated from the
+extracted info, and waiting jobs move up a bucket every SIZE_AGING seconds
+so large downloads are delayed but never starved
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional
+
+from yt_dlp.utils import parse_bytes
+
+from .bandwidth import parse_weights
+from .executors import pool_size, DOWNLOAD_WORKERS
+from .metrics import registry, Counter, Gauge, Histogram, BYTES_DOWNLOADED
+
+logger = logging.getLogger(__name__)
+
+ADJUST_INTERVAL = 5.0  # seconds between controller steps
+ERROR_RATIO = 0.05  # failed transfers per transfer that count as congestion
+FRAGMENT_ERROR_RATIO = 0.05  # failed fragments per fragment that count as congestion
+LATENCY_FACTOR = 2.0  # time to first byte this far above baseline counts as congestion
+MIN_GAIN = 1.05  # throughput an added slot must bring to keep growing
+THROUGHPUT_DROP = 0.7  # throughput falling below this share after growing counts as congestion
+DECREASE_FACTOR = 0.5
+
+ADAPTIVE = os.environ.get('ADAPTIVE_CONCURRENCY', '1').lower() not in ('0', 'false', 'no', 'off')
+MIN_SLOTS = min(pool_size('DOWNLOAD_SLOTS_MIN', 1), DOWNLOAD_WORKERS)
+INITIAL_SLOTS = min(max(pool_size('DOWNLOAD_SLOTS_INITIAL', 4), MIN_SLOTS), DOWNLOAD_WORKERS)
+
+JOB_CLASSES = ('interactive', 'batch', 'subscription')  # priority lanes, highest first
+SCHEDULER_POLICY = os.environ.get('SCHEDULER_POLICY', 'weighted')  # 'strict' or 'weighted'
+SCHEDULER_WEIGHTS = parse_weights(os.environ.get('SCHEDULER_WEIGHTS', ''),
+                                  {'interactive': 8, 'batch': 2, 'subscription': 1})
+INTERACTIVE_HEADROOM = int(os.environ.get('INTERACTIVE_HEADROOM', 1))  # slots above the limit only interactive jobs may use
+CLIENT_WEIGHTS = parse_weights(os.environ.get('CLIENT_WEIGHTS', ''), {})  # unlisted clients weigh 1
+CLIENT_MAX_ACTIVE = int(os.environ.get('CLIENT_MAX_ACTIVE', 0))  # slots one client may hold, 0 for no cap
+CLIENT_MAX_QUEUED = int(os.environ.get('CLIENT_MAX_QUEUED', 0))  # jobs one client may have waiting, 0 for no quota
+CLIENT_HEADER = os.environ.get('CLIENT_ID_HEADER', 'X-API-Key')  # identifies a submitter, the client IP otherwise
+SCHEDULER_ORDER = os.environ.get('SCHEDULER_ORDER', 'size')  # 'size' buckets or 'fifo' within a submitter's jobs
+SIZE_BUCKETS = [parse_bytes(size) for size in os.environ.get('SIZE_BUCKETS', '100M,1G').split(',')]  # bucket upper bounds
+SIZE_AGING = float(os.environ.get('SIZE_AGING', 300))  # seconds of waiting that promote a job one bucket
+
+# Failures that mean a source is overloaded or throttling us, rather than a bad URL
+CONGESTION_MARKERS = ('HTTP Error 429', 'Too Many Requests', 'HTTP Error 5', 'timed out', 'Connection reset',
+                      'Connection refused', 'Remote end closed', 'IncompleteRead')
+
+SLOT_ADJUSTMENTS = registry.register(Counter(
+    'ytdlp_co2_download_slot_adjustments_total', 'Changes of the adaptive download slot limit', ('direction', 'reason')))
+SLOT_WAIT = registry.register(Histogram(
+    'ytdlp_co2_download_slot_wait_seconds', 'Time downloads queued for a slot', ('job_class',),
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)))
+
+
+def is_congestion_error(error: Exception) -> bool:
+    message = str(error)
+    return any(marker in message for marker in CONGESTION_MARKERS)
+
+
+def finite(seconds: float) -> Optional[float]:
+    return None if math.isinf(seconds) else round(seconds, 1)
+
+
+def size_bucket(size: Optional[float]) -> int:
+    if size is None:
+        # Unknown sizes neither jump ahead of known small jobs nor sink behind large ones
+        return len(SIZE_BUCKETS) // 2
+    for bucket, bound in enumerate(SIZE_BUCKETS):
+        if size < bound:
+            return bucket
+    return len(SIZE_BUCKETS)
+
+
+class AdaptiveSlots:
+    """Download slot pool resized by an AIMD controller, handed out by priority lane"""
+
+    def __init__(self, limit: int, minimum: int, maximum: int, adaptive: bool = True,
+                 policy: str = SCHEDULER_POLICY, weights: Dict[str, float] = None,
+                 client_weights: Dict[str, float] = None, client_cap: int = CLIENT_MAX_ACTIVE,
+                 order: str = SCHEDULER_ORDER):
+        self.limit = limit if adaptive else maximum
+        self.minimum = minimum
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self.active = 0
+        # Lanes hold waiter dicts, virtual time drives the weighted policy
+        self.policy = policy
+        self.weights = weights or SCHEDULER_WEIGHTS
+        self.lanes: Dict[str, deque] = {job_class: deque() for job_class in JOB_CLASSES}
+        self.virtual_time: Dict[str, float] = {job_class: 0.0 for job_class in JOB_CLASSES}
+        # Fair queuing between clients: slots held and virtual finish time per client
+        self.client_weights = CLIENT_WEIGHTS if client_weights is None else client_weights
+        self.client_cap = client_cap
+        self.client_active: Dict[str, int] = {}
+        self.client_time: Dict[str, float] = {}
+        self.client_clock = 0.0
+        self.order = order
+        # Signals reported from download threads
+        self.lock = threading.Lock()
+        self.successes = 0
+        self.errors = 0
+        # Fragments are counted apart, one transfer fetches hundreds of them
+        self.fragment_successes = 0
+        self.fragment_errors = 0
+        self.latencies: List[float] = []
+        self.started: Dict[str, float] = {}
+        # Controller state
+        self.baseline_latency: Optional[float] = None
+        self.last_bytes = 0.0
+        self.last_adjust = time.monotonic()
+        self.last_throughput: Optional[float] = None
+        self.last_step = 'hold'
+        self.last_reason = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def has_room(self, job_class: str) -> bool:
+        if self.active < self.limit:
+            return True
+        return job_class == 'interactive' and self.active < min(self.maximum, self.limit + INTERACTIVE_HEADROOM)
+
+    def rank(self, waiter: Dict[str, Any], now: float) -> tuple:
+        if self.order == 'fifo':
+            return (0, waiter['queued'])
+        promoted = int((now - waiter['queued']) / SIZE_AGING)
+        return (max(0, size_bucket(waiter['size']) - promoted), waiter['queued'])
+
+    def next_waiter(self, job_class: str) -> Optional[Dict[str, Any]]:
+        """The client furthest behind its fair share, skipping capped ones, and that client's best ranked job"""
+        now = time.monotonic()
+        best: Dict[str, Dict[str, Any]] = {}
+        for waiter in self.lanes[job_class]:
+            client = waiter['client']
+            if self.client_cap and self.client_active.get(client, 0) >= self.client_cap:
+                continue
+            if client not in best or self.rank(waiter, now) < self.rank(best[client], now):
+                best[client] = waiter
+        if not best:
+            return None
+        return best[min(best, key=lambda client: self.client_time[client])]
+
+    def dispatch(self):
+        """Hand free slots to waiters, called whenever a slot frees up or the limit changes"""
+        while True:
+            # Interactive headroom can still admit the interactive lane when the others must wait
+            ready = {job_class: waiter for job_class in JOB_CLASSES
+                     if self.has_room(job_class) and (waiter := self.next_waiter(job_class)) is not None}
+            if not ready:
+                return
+            if self.policy == 'strict':
+                job_class = next(iter(ready))
+            else:
+                # Weighted: the lane that has received the least service for its weight, ties to the higher priority
+                job_class = min(ready, key=lambda job_class: self.virtual_time[job_class])
+            waiter = ready[job_class]
+            self.lanes[job_class].remove(waiter)
+            if waiter['future'].done():
+                continue
+            client = waiter['client']
+            self.virtual_time[job_class] += 1 / self.weights.get(job_class, 1)
+            self.client_clock = self.client_time[client]
+            self.client_time[client] += 1 / self.client_weights.get(client, 1)
+            self.client_active[client] = self.client_active.get(client, 0) + 1
+            self.active += 1
+            waiter['future'].set_result(job_class)
+
+    def queued_for(self, client: str) -> int:
+        return sum(waiter['client'] == client for lane in self.lanes.values() for waiter in lane)
+
+    def release(self, client: str):
+        self.active -= 1
+        self.client_active[client] -= 1
+        if not self.client_active[client]:
+            del self.client_active[client]
+        self.forget_client(client)
+        self.dispatch()
+
+    def forget_client(self, client: str):
+        # An idle client rejoins at the current virtual clock, so idling banks no credit
+        if client not in self.client_active and not self.queued_for(client):
+            self.client_time.pop(client, None)
+
+    @asynccontextmanager
+    async def slot(self, job_id: str, job_class: str = 'interactive', client: str = 'local', size: Optional[float] = None):
+        if job_class not in self.lanes:
+            job_class = 'interactive'
+        lane = self.lanes[job_class]
+        if not lane:
+            # A lane that was idle must not bank credit, it rejoins at the current virtual time
+            busy = [self.virtual_time[other] for other in JOB_CLASSES if self.lanes[other]]
+            if busy:
+                self.virtual_time[job_class] = max(self.virtual_time[job_class], min(busy))
+        self.client_time.setdefault(client, self.client_clock)
+        future = asyncio.get_event_loop().create_future()
+        queued = time.monotonic()
+        lane.append({'job_id': job_id, 'future': future, 'client': client, 'size': size, 'queued': queued})
+        self.dispatch()
+        try:
+            job_class = await future
+        except BaseException:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as the wait was cancelled
+                self.release(client)
+            else:
+                self.remove(job_id)
+                self.forget_client(client)
+            raise
+        SLOT_WAIT.observe(time.monotonic() - queued, job_class=job_class)
+        self.started[job_id] = time.monotonic()
+        try:
+            yield
+        finally:
+            self.started.pop(job_id, None)
+            self.release(client)
+
+    def find(self, job_id: str):
+        for job_class, lane in self.lanes.items():
+            for waiter in lane:
+                if waiter['job_id'] == job_id:
+                    return job_class, waiter
+        return None, None
+
+    def remove(self, job_id: str):
+        job_class, waiter = self.find(job_id)
+        if waiter is not None:
+            self.lanes[job_class].remove(waiter)
+
+    def reprioritize(self, job_id: str, job_class: str) -> bool:
+        """Move a queued job to another lane, returns False if it is not waiting for a slot"""
+        current, waiter = self.find(job_id)
+        if waiter is None:
+            return False
+        self.lanes[current].remove(waiter)
+        self.lanes[job_class].append(waiter)
+        self.dispatch()
+        return True
+
+    def interrupt(self, job_id: str, error: BaseException):
+        """Raise error in a job that is waiting for a slot, so a pause or cancel applies right away"""
+        job_class, waiter = self.find(job_id)
+        if waiter is not None:
+            self.lanes[job_class].remove(waiter)
+            self.forget_client(waiter['client'])
+            if not waiter['future'].done():
+                waiter['future'].set_exception(error)
+
+    def projection(self, running: Dict[str, Optional[float]]) -> Dict[str, Any]:
+        """Projected start and completion of queued jobs in seconds from now, given running jobs' remaining seconds"""
+        # Queued jobs are laid out in the order the scheduler would pick them if nothing else arrived,
+        # each transferring at the current throughput per slot
+        per_slot = (self.last_throughput or 0) / max(self.active, 1)
+        known = [waiter['size'] for lane in self.lanes.values() for waiter in lane if waiter['size']]
+        typical = statistics.median(known) if known else None
+        # Slots free up as running jobs finish, jobs with no ETA are assumed to take one typical job
+        typical_time = typical / per_slot if typical and per_slot else math.inf
+        free = sorted(remaining if remaining is not None else typical_time for remaining in running.values())
+        free += [0.0] * max(0, self.limit - len(free))
+        free = free[:max(self.limit, 1)]
+        heapq.heapify(free)
+
+        now = time.monotonic()
+        lane_order = {job_class: index for index, job_class in enumerate(JOB_CLASSES)}
+        queue = sorted(((job_class, waiter) for job_class, lane in self.lanes.items() for waiter in lane),
+                       key=lambda item: ((lane_order[item[0]] if self.policy == 'strict' else 0),
+                                         self.rank(item[1], now)))
+        jobs, lanes = {}, {}
+        for job_class, waiter in queue:
+            size = waiter['size'] or typical
+            start = heapq.heappop(free)
+            completion = start + size / per_slot if size and per_slot else math.inf
+            heapq.heappush(free, completion)
+            jobs[waiter['job_id']] = {'job_class': job_class, 'client': waiter['client'], 'size': waiter['size'],
+                                      'start_in': finite(start), 'complete_in': finite(completion)}
+            lanes[job_class] = max(lanes.get(job_class, 0.0), completion)
+        return {'throughput_per_slot': per_slot, 'jobs': jobs,
+                'lanes_drained_in': {job_class: finite(drained) for job_class, drained in lanes.items()}}
+
+    def first_bytes(self, job_id: str):
+        """Time to first byte of a job's transfer, reported once per slot from its progress hook"""
+        started = self.started.pop(job_id, None)
+        if started is not None:
+            with self.lock:
+                self.latencies.append(time.monotonic() - started)
+
+    def record_success(self):
+        with self.lock:
+            self.successes += 1
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def record_fragment(self, success: bool):
+        with self.lock:
+            if success:
+                self.fragment_successes += 1
+            else:
+                self.fragment_errors += 1
+
+    def congestion(self, throughput: float, errors: int, successes: int, latencies: List[float],
+                   fragment_errors: int = 0, fragment_successes: int = 0) -> Optional[str]:
+        if errors and errors >= ERROR_RATIO * (errors + successes):
+            return 'errors'
+        if fragment_errors and fragment_errors >= FRAGMENT_ERROR_RATIO * (fragment_errors + fragment_successes):
+            return 'fragment_errors'
+        if latencies and self.baseline_latency and statistics.median(latencies) > LATENCY_FACTOR * self.baseline_latency:
+            return 'latency'
+        if self.last_step == 'increase' and self.last_throughput and throughput < THROUGHPUT_DROP * self.last_throughput:
+            return 'throughput'
+        return None
+
+    async def adjust(self):
+        """One controller step"""
+        now = time.monotonic()
+        elapsed = max(now - self.last_adjust, 1e-6)
+        downloaded = BYTES_DOWNLOADED.values.get((), 0)
+        throughput = (downloaded - self.last_bytes) / elapsed
+        with self.lock:
+            errors, successes, latencies = self.errors, self.successes, self.latencies
+            fragment_errors, fragment_successes = self.fragment_errors, self.fragment_successes
+            self.errors, self.successes, self.latencies = 0, 0, []
+            self.fragment_errors, self.fragment_successes = 0, 0
+        self.last_adjust, self.last_bytes = now, downloaded
+
+        reason = self.congestion(throughput, errors, successes, latencies, fragment_errors, fragment_successes)
+        if reason:
+            step = 'decrease'
+            limit = max(self.minimum, int(self.limit * DECREASE_FACTOR))
+        else:
+            if latencies:
+                median = statistics.median(latencies)
+                self.baseline_latency = median if self.baseline_latency is None else 0.8 * self.baseline_latency + 0.2 * median
+            # Only grow while jobs are queued, and stop once another slot no longer adds throughput
+            no_gain = self.last_step == 'increase' and self.last_throughput and throughput < MIN_GAIN * self.last_throughput
+            if self.waiting and self.active >= self.limit and not no_gain:
+                step, reason = 'increase', 'queued'
+                limit = min(self.maximum, self.limit + 1)
+            else:
+                step, limit = 'hold', self.limit
+
+        if limit != self.limit:
+            logger.info(f"Download slots {self.limit} -> {limit} ({reason}, {throughput / 1e6:.1f} MB/s, "
+                        f"{errors} errors, {fragment_errors} fragment errors)")
+            SLOT_ADJUSTMENTS.inc(direction=step, reason=reason)
+            self.limit = limit
+            self.dispatch()
+        else:
+            step, reason = 'hold', reason if step == 'hold' else 'bounds'
+        self.last_step, self.last_reason, self.last_throughput = step, reason, throughput
+
+    async def run(self, interval: float = ADJUST_INTERVAL):
+        if not self.adaptive:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.adjust()
+            except Exception as e:
+                logger.error(f"Concurrency controller step failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'adaptive': self.adaptive,
+            'limit': self.limit,
+            'min': self.minimum,
+            'max': self.maximum,
+            'active': self.active,
+            'queued': self.waiting,
+            'policy': self.policy,
+            'order': self.order,
+            'lanes': {job_class: [waiter['job_id'] for waiter in lane] for job_class, lane in self.lanes.items()},
+            'clients': {client: {'active': self.client_active.get(client, 0), 'queued': self.queued_for(client)}
+                        for client in self.client_time},
+            'last_step': self.last_step,
+            'last_reason': self.last_reason,
+            'throughput': self.last_throughput,
+            'baseline_latency': self.baseline_latency,
+        }
+
+
+download_slots = AdaptiveSlots(INITIAL_SLOTS, MIN_SLOTS, DOWNLOAD_WORKERS, ADAPTIVE)
+
+registry.register(Gauge('ytdlp_co2_download_slots', 'Current adaptive limit of simultaneous downloads',
+                        function=lambda: download_slots.limit))
+registry.register(Gauge('ytdlp_co2_download_slots_active', 'Downloads holding a slot',
+                        function=lambda: download_slots.active))
+registry.register(Gauge('ytdlp_co2_download_slots_queued', 'Downloads waiting for a slot',
+                        function=lambda: download_slots.waiting))
@@ -0,0 +1,65 @@
+"""
+Cooperative cancel and pause for running jobs
+A request is only recorded here. The job's progress hook raises it on the
+download thread, so yt-dlp unwinds cleanly, the worker slot is freed and
+partial files stay on disk for a later resume
+"""
+
+import threading
+from typing import Dict, Optional
+
+from yt_dlp.utils import DownloadCancelled
+
+CANCEL = 'cancel'
+PAUSE = 'pause'
+SUSPEND = 'suspend'  # server shutdown, the job resumes on the next start
+
+
+class JobInterrupted(DownloadCancelled):
+    msg = 'Job interrupted'
+
+
+class JobCancelled(JobInterrupted):
+    msg = 'Cancelled by user'
+
+
+class JobPaused(JobInterrupted):
+    msg = 'Paused by user'
+
+
+class JobSuspended(JobInterrupted):
+    msg = 'Server shutting down'
+
+
+class JobControl:
+    """Pending cancel/pause requests by download ID"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests: Dict[str, str] = {}
+
+    def request(self, download_id: str, action: str):
+        with self.lock:
+            # Cancelling wins over a pause that has not taken effect yet
+            if self.requests.get(download_id) != CANCEL:
+                self.requests[download_id] = action
+
+    def pending(self, download_id: str) -> Optional[str]:
+        return self.requests.get(download_id)
+
+    def check(self, download_id: str):
+        """Raise the pending request for a job, called from its download thread"""
+        action = self.requests.get(download_id)
+        if action == CANCEL:
+            raise JobCancelled()
+        if action == PAUSE:
+            raise JobPaused()
+        if action == SUSPEND:
+            raise JobSuspended()
+
+    def clear(self, download_id: str):
+        with self.lock:
+            self.requests.pop(download_id, None)
+
+
+job_control = JobControl()
@@ -0,0 +1,128 @@
+"""
+Disk space admission control
+Before a transfer starts, its job reserves the estimated output size times
+DISK_HEADROOM (partial files, merge output and post-processing copies exist
+side by side) against the free space of the download volume. A reservation
+shrinks as the job writes, so space counts once. Jobs that do not fit stay
+queued, first come first served, until running jobs finish or space is
+freed, instead of all failing halfway when the volume fills up. A job that
+would not fit even on an otherwise idle volume fails right away
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Any, Callable, Optional
+
+from yt_dlp.utils import parse_bytes
+
+logger = logging.getLogger(__name__)
+
+DISK_HEADROOM = float(os.environ.get('DISK_HEADROOM', 2.0))  # reserved bytes per estimated output byte
+DISK_MIN_FREE = parse_bytes(os.environ.get('DISK_MIN_FREE', '1G')) or 0  # always left free on the volume
+UNKNOWN_SIZE = parse_bytes(os.environ.get('DISK_UNKNOWN_RESERVE', '500M')) or 0  # reserved for jobs of unknown size
+RECHECK_INTERVAL = 2.0  # seconds between free space checks while jobs are held
+
+
+class InsufficientSpace(Exception):
+    """The job cannot fit on the volume even with nothing else running"""
+
+
+class DiskSpace:
+    def __init__(self, path: Path, min_free: int = DISK_MIN_FREE, headroom: float = DISK_HEADROOM):
+        self.path = path
+        self.min_free = min_free
+        self.headroom = headroom
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str, float]] = {}
+        self.held: Dict[str, float] = {}
+        self.released = asyncio.Event()
+
+    def free(self) -> int:
+        return shutil.disk_usage(self.path).free
+
+    def outstanding(self) -> float:
+        """Reserved bytes not yet written, called with the lock held"""
+        return sum(max(0.0, job['reserved'] - job['written']) for job in self.jobs.values())
+
+    def available(self) -> float:
+        with self.lock:
+            return self.free() - self.min_free - self.outstanding()
+
+    def own(self, job_id: str) -> float:
+        """Unwritten part of the job's current reservation, called with the lock held"""
+        current = self.jobs.get(job_id)
+        return max(0.0, current['reserved'] - current['written']) if current else 0.0
+
+    def fits(self, job_id: str, need: float) -> bool:
+        with self.lock:
+            # A job replacing its own reservation, e.g. the next item of a batch, does not compete with itself
+            return need <= self.free() - self.min_free - (self.outstanding() - self.own(job_id))
+
+    def ensure_possible(self, job_id: str, need: float):
+        with self.lock:
+            # Files other jobs already wrote stay, so free space is the most an idle volume could offer
+            capacity = self.free() - self.min_free + self.own(job_id)
+        if need > capacity:
+            raise InsufficientSpace(f"Not enough disk space on {self.path}: needs {need / 1e9:.2f} GB, "
+                                    f"{max(capacity, 0) / 1e9:.2f} GB can be used")
+
+    async def reserve(self, job_id: str, size: Optional[float], check: Callable[[], None] = None,
+                      headroom: float = None):
+        """Wait until size (with headroom) fits on the volume and reserve it, check() may raise to abort the wait"""
+        need = (size or UNKNOWN_SIZE) * (self.headroom if headroom is None else headroom)
+        self.ensure_possible(job_id, need)
+        # Held jobs are admitted in arrival order, so a stream of small jobs cannot starve a large one
+        self.held[job_id] = need
+        try:
+            if next(iter(self.held)) != job_id or not self.fits(job_id, need):
+                logger.info(f"Download {job_id} held until {need / 1e9:.2f} GB fit on {self.path}")
+            while next(iter(self.held)) != job_id or not self.fits(job_id, need):
+                if check is not None:
+                    check()
+                self.released.clear()
+                try:
+                    # Finished jobs wake the queue, space freed outside the server is seen on the next check
+                    await asyncio.wait_for(self.released.wait(), RECHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                if next(iter(self.held)) == job_id:
+                    self.ensure_possible(job_id, need)
+        finally:
+            self.held.pop(job_id, None)
+            # The next held job may fit now
+            self.released.set()
+        with self.lock:
+            self.jobs[job_id] = {'reserved': need, 'written': 0.0}
+
+    def written(self, job_id: str, amount: int):
+        """Bytes a job wrote, reported from its progress hook"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['written'] += amount
+
+    def release(self, job_id: str):
+        """Drop a job's reservation, together with per-item ones named job_id/item"""
+        with self.lock:
+            keys = [key for key in self.jobs if key == job_id or key.startswith(f'{job_id}/')]
+            for key in keys:
+                del self.jobs[key]
+            released = bool(keys)
+        if released:
+            self.released.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'path': str(self.path),
+                'free': self.free(),
+                'min_free': self.min_free,
+                'headroom': self.headroom,
+                'reserved': self.outstanding(),
+                'jobs': {job_id: dict(job) for job_id, job in self.jobs.items()},
+                'held': dict(self.held),
+            }
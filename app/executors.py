@@ -0,0 +1,115 @@
+"""
+Named thread pools for blocking work
+Metadata extraction, network downloads, post-processing and moving staged
+files to the download volume each get their own pool so long transfers
+cannot starve quick /formats or /info lookups. Pool sizes come from the
+environment and every pool reports saturation metrics.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+
+from .metrics import registry, Counter, Gauge, Histogram
+
+
+def pool_size(variable: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(variable, default)))
+    except ValueError:
+        return default
+
+
+EXTRACTION_WORKERS = pool_size('EXTRACTION_WORKERS', 8)
+DOWNLOAD_WORKERS = pool_size('DOWNLOAD_WORKERS', min(32, (os.cpu_count() or 1) + 4))
+POSTPROCESS_WORKERS = pool_size('POSTPROCESS_WORKERS', os.cpu_count() or 1)
+MOVE_WORKERS = pool_size('MOVE_WORKERS', 2)
+
+EXECUTOR_WAIT = registry.register(Histogram(
+    'ytdlp_co2_executor_wait_seconds', 'Time work items spent queued before an executor thread picked them up',
+    ('executor',), buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120, 600)))
+EXECUTOR_TASKS = registry.register(Counter(
+    'ytdlp_co2_executor_tasks_total', 'Work items finished by each executor', ('executor',)))
+
+
+class NamedExecutor(ThreadPoolExecutor):
+    """Thread pool that tracks queued and running work for the metrics endpoint"""
+
+    def __init__(self, name: str, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=f'{name}-worker')
+        self.name = name
+        self.queued = 0
+        self.running = 0
+        self.counts_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted = time.monotonic()
+        with self.counts_lock:
+            self.queued += 1
+
+        def run():
+            EXECUTOR_WAIT.observe(time.monotonic() - submitted, executor=self.name)
+            with self.counts_lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.counts_lock:
+                    self.running -= 1
+                EXECUTOR_TASKS.inc(executor=self.name)
+
+        try:
+            future = super().submit(run)
+        except RuntimeError:
+            with self.counts_lock:
+                self.queued -= 1
+            raise
+        future.add_done_callback(self.dequeue_cancelled)
+        return future
+
+    def dequeue_cancelled(self, future):
+        """Work cancelled before a thread picked it up, e.g. by shutdown, never runs to leave the queue itself"""
+        if future.cancelled():
+            with self.counts_lock:
+                self.queued -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.counts_lock:
+            queued, running = self.queued, self.running
+        return {
+            'max_workers': self._max_workers,
+            'threads': len(self._threads),
+            'running': running,
+            'queued': queued,
+            'utilization': running / self._max_workers,
+        }
+
+
+extraction_executor = NamedExecutor('extraction', EXTRACTION_WORKERS)
+download_executor = NamedExecutor('download', DOWNLOAD_WORKERS)
+postprocess_executor = NamedExecutor('postprocess', POSTPROCESS_WORKERS)
+move_executor = NamedExecutor('move', MOVE_WORKERS)
+executors = {executor.name: executor
+             for executor in (extraction_executor, download_executor, postprocess_executor, move_executor)}
+
+
+def executor_stats(field: str) -> Dict[tuple, Any]:
+    return {(name,): executor.stats()[field] for name, executor in executors.items()}
+
+
+def shutdown_executors():
+    for executor in executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+registry.register(Gauge('ytdlp_co2_executor_queue_depth', 'Work items waiting for an executor thread', ('executor',),
+                        function=lambda: executor_stats('queued')))
+registry.register(Gauge('ytdlp_co2_executor_running', 'Work items currently running on an executor', ('executor',),
+                        function=lambda: executor_stats('running')))
+registry.register(Gauge('ytdlp_co2_executor_threads', 'Threads started by the executor', ('executor',),
+                        function=lambda: executor_stats('threads')))
+registry.register(Gauge('ytdlp_co2_executor_max_threads', 'Executor thread limit', ('executor',),
+                        function=lambda: executor_stats('max_workers')))
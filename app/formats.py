@@ -0,0 +1,191 @@
+"""
+Columnar format table for filtering and ranking extracted formats
+Large DASH/HLS manifests are filtered and sorted on per-field columns and
+only the selected top-k rows are turned back into response dicts
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+
+from yt_dlp.utils import parse_bytes, parse_filesize
+
+# Codec preference, best first, matched by prefix like yt-dlp's -S vcodec/acodec
+VCODEC_ORDER = [('av01',), ('vp9.2', 'vp09.02'), ('vp9', 'vp09'), ('h265', 'hev', 'hvc'), ('h264', 'avc'), ('vp8',), ('h263',), ('theora',)]
+ACODEC_ORDER = [('flac', 'alac'), ('wav', 'aiff'), ('opus',), ('vorbis',), ('aac', 'mp4a'), ('mp3',), ('ac4',), ('eac3', 'ec-3'), ('ac3', 'ac-3'), ('dts',)]
+
+# yt-dlp sort field aliases mapped onto table columns
+SORT_FIELDS = {
+    'res': 'height',
+    'height': 'height',
+    'width': 'width',
+    'fps': 'fps',
+    'br': 'tbr',
+    'tbr': 'tbr',
+    'vbr': 'vbr',
+    'abr': 'abr',
+    'asr': 'asr',
+    'size': 'filesize',
+    'filesize': 'filesize',
+    'vcodec': 'vcodec_rank',
+    'acodec': 'acodec_rank',
+    'codec': 'vcodec_rank',
+}
+DEFAULT_SORT = 'res,fps,vcodec,acodec,size,br'
+
+NUMERIC_COLUMNS = ['height', 'width', 'fps', 'tbr', 'vbr', 'abr', 'asr', 'filesize']
+
+
+def parse_size_limit(value: str) -> int:
+    """Bytes of a size like '500M', '1.5G' or '700MiB', ValueError if it does not parse"""
+    limit = parse_bytes(value.strip()) or parse_filesize(value.strip())
+    if limit is None:
+        raise ValueError(f"Invalid max_filesize: {value}")
+    return limit
+
+
+def parse_sort(sort: Optional[str]) -> List[Tuple[str, bool, Optional[float]]]:
+    """(column, ascending, limit) per sort key, ValueError for limits that are not numbers"""
+    keys = []
+    for key in (sort or DEFAULT_SORT).split(','):
+        key = key.strip()
+        ascending = key.startswith('+')
+        name, _, limit = key.lstrip('+').partition(':')
+        column = SORT_FIELDS.get(name)
+        if column is None:
+            continue
+        try:
+            # 'res:720p' and the like mean the number in front
+            keys.append((column, ascending, float(limit.rstrip('p')) if limit else None))
+        except ValueError:
+            raise ValueError(f"Invalid sort limit: {key}") from None
+    return keys
+
+
+def codec_rank(codec: Optional[str], order) -> Optional[int]:
+    """Higher is better, None for missing codecs"""
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    for rank, prefixes in enumerate(order):
+        if codec.startswith(prefixes):
+            return len(order) - rank
+    return 0
+
+
+class FormatTable:
+    """Column-per-field view of an info dict's formats"""
+
+    def __init__(self, formats: List[Dict[str, Any]]):
+        self.formats = formats
+        self.columns: Dict[str, List[Any]] = {name: [] for name in NUMERIC_COLUMNS}
+        self.columns.update(ext=[], vcodec=[], acodec=[], vcodec_rank=[], acodec_rank=[])
+        for f in formats:
+            for name in NUMERIC_COLUMNS:
+                self.columns[name].append(f.get(name))
+            if f.get('filesize') is None:
+                self.columns['filesize'][-1] = f.get('filesize_approx')
+            self.columns['ext'].append(f.get('ext'))
+            self.columns['vcodec'].append(f.get('vcodec') or 'none')
+            self.columns['acodec'].append(f.get('acodec') or 'none')
+            self.columns['vcodec_rank'].append(codec_rank(f.get('vcodec'), VCODEC_ORDER))
+            self.columns['acodec_rank'].append(codec_rank(f.get('acodec'), ACODEC_ORDER))
+
+    def __len__(self):
+        return len(self.formats)
+
+    def filter(self, vcodec: str = None, acodec: str = None, ext: str = None,
+               min_height: int = None, max_height: int = None,
+               min_tbr: float = None, max_tbr: float = None, max_filesize: int = None) -> List[int]:
+        """Indices of formats matching every given constraint"""
+        indices = range(len(self))
+
+        def keep(column, predicate):
+            values = self.columns[column]
+            return [i for i in indices if predicate(values[i])]
+
+        if vcodec:
+            vcodecs = tuple(v.strip().lower() for v in vcodec.split(','))
+            indices = keep('vcodec', lambda v: v.lower().startswith(vcodecs))
+        if acodec:
+            acodecs = tuple(a.strip().lower() for a in acodec.split(','))
+            indices = keep('acodec', lambda a: a.lower().startswith(acodecs))
+        if ext:
+            exts = {e.strip().lower() for e in ext.split(',')}
+            indices = keep('ext', lambda e: (e or '').lower() in exts)
+        if min_height is not None:
+            indices = keep('height', lambda h: h is not None and h >= min_height)
+        if max_height is not None:
+            indices = keep('height', lambda h: h is not None and h <= max_height)
+        if min_tbr is not None:
+            indices = keep('tbr', lambda t: t is not None and t >= min_tbr)
+        if max_tbr is not None:
+            indices = keep('tbr', lambda t: t is not None and t <= max_tbr)
+        if max_filesize is not None:
+            # Formats with unknown size can't be ruled out
+            indices = keep('filesize', lambda s: s is None or s <= max_filesize)
+        return list(indices)
+
+    def sort(self, indices: List[int], sort: List[Tuple[str, bool, Optional[float]]] = None) -> List[int]:
+        """Order indices by yt-dlp style sort keys, best first
+
+        Keys are descending by default, a leading '+' makes them ascending and
+        'field:limit' prefers the largest values not exceeding limit.
+        Missing values always sort last. Keys come from parse_sort.
+        """
+        fields = [(self.columns[column], ascending, limit)
+                  for column, ascending, limit in (parse_sort(None) if sort is None else sort)]
+
+        def sort_key(i):
+            key = []
+            for values, ascending, limit in fields:
+                value = values[i]
+                if value is None:
+                    key.append((0, 0, 0))
+                elif limit is not None:
+                    key.append((1, value <= limit, value if value <= limit else -value))
+                else:
+                    key.append((1, 1, -value if ascending else value))
+            return key
+
+        return sorted(indices, key=sort_key, reverse=True)
+
+    def rows(self, indices: List[int]) -> List[Dict[str, Any]]:
+        rows = []
+        for i in indices:
+            f = self.formats[i]
+            if f.get('height'):
+                quality = f"{f['height']}p"
+            elif f.get('abr'):
+                quality = f"{f['abr']}kbps"
+            else:
+                quality = "Unknown"
+
+            rows.append({
+                'format_id': f['format_id'],
+                'ext': f.get('ext', 'unknown'),
+                'quality': quality,
+                'filesize': self.columns['filesize'][i],
+                'vcodec': f.get('vcodec', 'none'),
+                'acodec': f.get('acodec', 'none'),
+                'fps': f.get('fps'),
+                'tbr': f.get('tbr')
+            })
+        return rows
+
+
+def format_size(f: Dict[str, Any], duration: Optional[float]) -> Optional[float]:
+    """Bytes of one format: its filesize, the approximation, or bitrate times duration"""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if not size and f.get('tbr') and duration:
+        size = f['tbr'] * 1000 / 8 * duration
+    return size
+
+
+def estimate_size(info: Dict[str, Any]) -> Optional[int]:
+    """Expected download size of a processed info dict, None if any part of it is unknown"""
+    if info.get('entries') is not None:
+        sizes = [estimate_size(entry) for entry in info['entries'] if entry]
+    else:
+        sizes = [format_size(f, info.get('duration')) for f in info.get('requested_formats') or [info]]
+    if not sizes or not all(sizes):
+        return None
+    return int(sum(sizes))
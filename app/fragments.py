@@ -0,0 +1,159 @@
+"""
+Server-wide fragment download budget
+concurrent_fragments sizes a job's fragment thread pool, but every fragment
+has to take a slot from one shared budget (FRAGMENT_WORKERS) before it opens
+a connection. A lone job can use the whole budget; when more jobs run, freed
+slots go to the job holding the fewest, so they converge on an even split.
+Each job's own fragment concurrency is AIMD controlled: it creeps back up
+by one slot per window of successful fragments and halves on a failure
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Any
+
+from yt_dlp.downloader.fragment import FragmentFD
+from yt_dlp.utils import DownloadCancelled
+
+from .concurrency import download_slots, is_congestion_error
+from .executors import pool_size
+from .metrics import registry, Gauge, Histogram
+
+FRAGMENT_WORKERS = pool_size('FRAGMENT_WORKERS', 32)
+JOB_PARAM = 'fragment_budget_job'  # extra YoutubeDL param naming the job a download draws for
+
+FRAGMENT_WAIT = registry.register(Histogram(
+    'ytdlp_co2_fragment_slot_wait_seconds', 'Time fragments waited for a slot in the fragment budget',
+    buckets=(0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30)))
+
+
+class FragmentBudget:
+    """Counting semaphore shared by all jobs, granting slots max-min fairly"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.condition = threading.Condition()
+        self.active: Dict[str, int] = {}
+        self.waiting: Dict[str, int] = {}
+        self.caps: Dict[str, float] = {}
+
+    def in_use(self) -> int:
+        return sum(self.active.values())
+
+    def cap(self, job_id: str) -> int:
+        return int(self.caps.get(job_id, self.limit))
+
+    def may_start(self, job_id: str) -> bool:
+        if self.in_use() >= self.limit:
+            return False
+        held = self.active.get(job_id, 0)
+        if held >= self.cap(job_id):
+            return False
+        # Waiters of jobs at their AIMD cap could not take a freed slot, so they do not hold others back
+        return all(held <= self.active.get(other, 0) for other in self.waiting
+                   if self.active.get(other, 0) < self.cap(other))
+
+    @contextmanager
+    def slot(self, job_id: str, requested: int):
+        started = time.monotonic()
+        with self.condition:
+            self.caps.setdefault(job_id, float(requested))
+            self.waiting[job_id] = self.waiting.get(job_id, 0) + 1
+            try:
+                while not self.may_start(job_id):
+                    self.condition.wait()
+            finally:
+                self.waiting[job_id] -= 1
+                if not self.waiting[job_id]:
+                    del self.waiting[job_id]
+            self.active[job_id] = self.active.get(job_id, 0) + 1
+            # Other jobs may have been held back only by this one's lower count
+            self.condition.notify_all()
+        FRAGMENT_WAIT.observe(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active[job_id] -= 1
+                if not self.active[job_id]:
+                    del self.active[job_id]
+                self.condition.notify_all()
+
+    def record(self, job_id: str, requested: int, success: bool):
+        """AIMD step for a job's fragment concurrency after one fragment"""
+        with self.condition:
+            cap = self.caps.get(job_id, float(requested))
+            cap = min(requested, cap + 1 / cap) if success else max(1.0, cap / 2)
+            changed = int(cap) != self.cap(job_id)
+            self.caps[job_id] = cap
+            if changed:
+                # A job reaching or leaving its cap changes who may take a slot
+                self.condition.notify_all()
+
+    def forget(self, job_id: str):
+        with self.condition:
+            self.caps.pop(job_id, None)
+            self.condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.condition:
+            return {
+                'max_workers': self.limit,
+                'running': self.in_use(),
+                'queued': sum(self.waiting.values()),
+                'jobs': dict(self.active),
+                'caps': {job_id: round(cap, 2) for job_id, cap in self.caps.items()},
+            }
+
+
+fragment_budget = FragmentBudget(FRAGMENT_WORKERS)
+
+
+def fragment_params(job_id: str, user_opts: Dict[str, Any]) -> Dict[str, Any]:
+    """YoutubeDL params for a job's fragment downloads, from the concurrent_fragments form option"""
+    try:
+        requested = max(1, int(user_opts.get('concurrent_fragments') or 1))
+    except (TypeError, ValueError):
+        requested = 1
+    # Threads beyond the budget could never get a slot
+    return {'concurrent_fragment_downloads': min(requested, FRAGMENT_WORKERS), JOB_PARAM: job_id}
+
+
+def record_fragment(job_id: str, requested: int, success: bool):
+    fragment_budget.record(job_id, requested, success)
+    download_slots.record_fragment(success)
+
+
+def budgeted(download_fragment):
+    @wraps(download_fragment)
+    def wrapper(self, *args, **kwargs):
+        job_id = self.params.get(JOB_PARAM)
+        if job_id is None:
+            return download_fragment(self, *args, **kwargs)
+        requested = self.params.get('concurrent_fragment_downloads', 1)
+        with fragment_budget.slot(job_id, requested):
+            try:
+                success = download_fragment(self, *args, **kwargs)
+            except DownloadCancelled:
+                raise
+            except Exception as e:
+                # HTTP errors such as 429s surface here, yt-dlp retries the fragment afterwards.
+                # Only overload counts, a 404 or an expired URL says nothing about the source's capacity
+                if is_congestion_error(e):
+                    record_fragment(job_id, requested, False)
+                raise
+        if success:
+            record_fragment(job_id, requested, True)
+        return success
+    return wrapper
+
+
+# Every fragment based downloader (HLS, DASH, ISM, F4M) fetches through this method
+FragmentFD._download_fragment = budgeted(FragmentFD._download_fragment)
+
+registry.register(Gauge('ytdlp_co2_fragment_slots_in_use', 'Fragment downloads holding a budget slot',
+                        function=lambda: fragment_budget.stats()['running']))
+registry.register(Gauge('ytdlp_co2_fragment_slots_waiting', 'Fragment downloads waiting for a budget slot',
+                        function=lambda: fragment_budget.stats()['queued']))
@@ -0,0 +1,213 @@
+"""
+Per-site request pacing and circuit breaking
+Extractions and downloads for one site (its yt-dlp extractor, or the
+hostname for generic URLs) share a request rate across all jobs. Throttling
+answers such as 429s, rate-limit messages or bot checks trip a breaker that
+holds that site's queued jobs for an exponentially growing back-off, while
+jobs for other sites keep flowing. After the back-off one job probes the
+site; if it is not throttled again within PROBE_WINDOW, the rest are let
+through
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+from urllib.parse import urlsplit
+
+from yt_dlp.extractor import gen_extractor_classes
+from yt_dlp.utils import DownloadCancelled
+
+from .executors import extraction_executor
+from .metrics import registry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+HOST_REQUEST_RATE = float(os.environ.get('HOST_REQUEST_RATE', 1))  # requests per second per site
+HOST_REQUEST_BURST = float(os.environ.get('HOST_REQUEST_BURST', 5))
+BREAKER_THRESHOLD = 3  # throttled failures in a row that open the breaker
+BACKOFF_INITIAL = float(os.environ.get('HOST_BACKOFF', 30))  # seconds
+BACKOFF_MAX = 15 * 60
+PROBE_WINDOW = 15.0  # seconds a probe must go unthrottled before the site is considered healthy
+HOST_RETRIES = 3  # attempts for a download that keeps getting throttled
+KEY_CACHE_LIMIT = 10000
+
+# Answers that mean the site is rate limiting us, not that the URL is bad. A bare 403 is left out:
+# geo-blocks, private videos and expired signed URLs answer 403 too, only the bot check or
+# rate-limit text next to it tells throttling apart
+THROTTLE_MARKERS = ('HTTP Error 429', 'Too Many Requests', 'not a bot', 'unusual traffic',
+                    'rate-limit', 'rate limit', 'rate-limited')
+
+BREAKER_TRIPS = registry.register(Counter(
+    'ytdlp_co2_host_breaker_trips_total', 'Times a site was put into back-off after throttling us', ('host',)))
+
+EXTRACTORS = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+
+
+class HostBackoff(Exception):
+    """Raised instead of waiting when a site is backing off"""
+
+
+def is_throttled(error: Exception) -> bool:
+    message = str(error)
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+
+def resolve_key(url: str) -> str:
+    """The extractor that handles url, or its hostname for sites only the generic extractor knows"""
+    for ie in EXTRACTORS:
+        if ie.suitable(url):
+            return ie.ie_key()
+    return (urlsplit(url).hostname or 'unknown').removeprefix('www.')
+
+
+class HostGate:
+    def __init__(self, rate: float = HOST_REQUEST_RATE, burst: float = HOST_REQUEST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.hosts: Dict[str, Dict[str, Any]] = {}
+        self.keys: Dict[str, str] = {}
+
+    async def key(self, url: str) -> str:
+        if url not in self.keys:
+            # Matching every extractor pattern the first time takes a while, keep it off the loop
+            if len(self.keys) >= KEY_CACHE_LIMIT:
+                self.keys.clear()
+            self.keys[url] = await asyncio.get_event_loop().run_in_executor(extraction_executor, resolve_key, url)
+        return self.keys[url]
+
+    def host(self, key: str) -> Dict[str, Any]:
+        if key not in self.hosts:
+            self.hosts[key] = {
+                'state': CLOSED,
+                'tokens': self.burst,
+                'updated': time.monotonic(),
+                'failures': 0,
+                'backoff': BACKOFF_INITIAL,
+                'open_until': 0.0,
+                'probe_started': None,
+                'last_error': None,
+            }
+        return self.hosts[key]
+
+    def close(self, key: str):
+        host = self.host(key)
+        if host['state'] != CLOSED:
+            logger.info(f"Site {key} recovered, resuming its queue")
+        # An empty bucket lets the held jobs back in at the request rate instead of all at once
+        host.update(state=CLOSED, failures=0, backoff=BACKOFF_INITIAL, probe_started=None,
+                    tokens=min(host['tokens'], 1.0), updated=time.monotonic())
+
+    async def acquire(self, url: str, wait: bool = True) -> str:
+        key = await self.key(url)
+        while True:
+            host = self.host(key)
+            now = time.monotonic()
+            if host['state'] == OPEN:
+                remaining = host['open_until'] - now
+                if remaining > 0:
+                    if not wait:
+                        raise HostBackoff(f"{key} is rate limiting requests, retrying in {remaining:.0f}s")
+                    # Short naps so a manual reset takes effect
+                    await asyncio.sleep(min(remaining, 1.0))
+                    continue
+                host['state'], host['probe_started'] = HALF_OPEN, None
+            if host['state'] == HALF_OPEN:
+                if host['probe_started'] is None:
+                    host['probe_started'] = now
+                    return key
+                if now - host['probe_started'] < PROBE_WINDOW:
+                    if not wait:
+                        raise HostBackoff(f"{key} is rate limiting requests, checking whether it recovered")
+                    await asyncio.sleep(0.5)
+                    continue
+                self.close(key)
+
+            host['tokens'] = min(self.burst, host['tokens'] + (now - host['updated']) * self.rate)
+            host['updated'] = now
+            if host['tokens'] >= 1:
+                host['tokens'] -= 1
+                return key
+            await asyncio.sleep((1 - host['tokens']) / self.rate)
+
+    def success(self, key: str):
+        host = self.host(key)
+        if host['state'] == HALF_OPEN:
+            self.close(key)
+        elif host['state'] == CLOSED:
+            host['failures'] = 0
+
+    def failure(self, key: str, error: Exception):
+        host = self.host(key)
+        if not is_throttled(error):
+            # Not the site pushing back, a half-open site lets the next job probe
+            if host['state'] == HALF_OPEN:
+                host['probe_started'] = None
+            return
+        host['failures'] += 1
+        host['last_error'] = str(error)[:200]
+        if host['state'] == OPEN or (host['state'] == CLOSED and host['failures'] < BREAKER_THRESHOLD):
+            return
+        host['state'] = OPEN
+        host['open_until'] = time.monotonic() + host['backoff']
+        logger.warning(f"Site {key} is throttling ({host['last_error']}), holding its jobs for {host['backoff']:.0f}s")
+        BREAKER_TRIPS.inc(host=key)
+        host['backoff'] = min(BACKOFF_MAX, host['backoff'] * 2)
+
+    def release(self, key: str):
+        """A request ended without telling anything about the site, e.g. cancelled"""
+        host = self.host(key)
+        if host['state'] == HALF_OPEN:
+            host['probe_started'] = None
+
+    @asynccontextmanager
+    async def request(self, url: str, wait: bool = True):
+        """Pace and guard one extraction or download against url's site"""
+        key = await self.acquire(url, wait)
+        try:
+            yield key
+        except DownloadCancelled:
+            self.release(key)
+            raise
+        except Exception as e:
+            self.failure(key, e)
+            raise
+        except BaseException:
+            self.release(key)
+            raise
+        else:
+            self.success(key)
+
+    def reset(self, key: str) -> bool:
+        if key not in self.hosts:
+            return False
+        self.close(key)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            key: {
+                'state': host['state'],
+                'failures': host['failures'],
+                'retry_in': max(0.0, host['open_until'] - now) if host['state'] == OPEN else 0.0,
+                'next_backoff': host['backoff'],
+                'last_error': host['last_error'],
+            }
+            for key, host in self.hosts.items()
+        }
+
+    def open_hosts(self) -> Dict[tuple, int]:
+        return {(key,): 1 for key, host in self.hosts.items() if host['state'] != CLOSED}
+
+
+host_gate = HostGate()
+
+registry.register(Gauge('ytdlp_co2_host_backoff', 'Sites whose queue is held after throttling (open or probing)',
+                        ('host',), function=host_gate.open_hosts))
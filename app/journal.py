@@ -0,0 +1,142 @@
+"""
+Crash-safe job journal
+Jobs are written to an fsynced append log when they start, updated as they
+progress and dropped when they reach a final state. Whatever is still in the
+journal after a restart was interrupted and can be resumed from its partial
+files. Records are written and fsynced by a writer thread, so callers on the
+event loop never wait for the disk; records queued together share one fsync.
+Once most of the log describes finished or superseded state, the writer
+compacts it again
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+COMPACT_MIN_RECORDS = 1000  # log records before the writer considers compacting
+COMPACT_RATIO = 0.5  # share of stale records that triggers a compaction
+
+
+class JobJournal:
+    """Append-only log of unfinished jobs, compacted on load and whenever it is mostly stale"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Reentrant, so a job change and its record are queued under one hold
+        self.lock = threading.RLock()
+        self.records = 0
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        if path.exists():
+            self.jobs = self.replay(path)
+        self.compact()
+        self.log = open(path, 'a', encoding='utf-8')
+        self.wake = threading.Condition(self.lock)
+        self.pending: List[str] = []
+        self.closed = False
+        self.writer = threading.Thread(target=self.write_loop, name='journal-writer', daemon=True)
+        self.writer.start()
+
+    @staticmethod
+    def replay(path: Path) -> Dict[str, Dict[str, Any]]:
+        jobs = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    logger.warning(f"Skipping corrupt journal record in {path}")
+                    continue
+                if record['op'] == 'start':
+                    jobs[record['id']] = record['job']
+                elif record['op'] == 'update' and record['id'] in jobs:
+                    jobs[record['id']].update(record['fields'])
+                elif record['op'] == 'finish':
+                    jobs.pop(record['id'], None)
+        return jobs
+
+    def snapshot(self) -> List[str]:
+        """One start record per unfinished job, called with the lock held"""
+        return [json.dumps({'op': 'start', 'id': job_id, 'job': job}) + '\n' for job_id, job in self.jobs.items()]
+
+    def compact(self, lines: List[str] = None):
+        tmp_file = self.path.with_suffix('.tmp')
+        lines = self.snapshot() if lines is None else lines
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_file.replace(self.path)
+        self.records = len(lines)
+
+    def compaction_due(self, queued: int) -> bool:
+        """Whether the log would be mostly stale records, called with the lock held"""
+        total = self.records + queued
+        return total >= COMPACT_MIN_RECORDS and total - len(self.jobs) >= COMPACT_RATIO * total
+
+    def append(self, record: Dict[str, Any]):
+        with self.lock:
+            self.pending.append(json.dumps(record) + '\n')
+            self.wake.notify_all()
+
+    def write_loop(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.wake.wait()
+                if not self.pending:
+                    return
+                lines, self.pending = self.pending, []
+                # The snapshot already holds what the queued records describe
+                snapshot = self.snapshot() if self.compaction_due(len(lines)) else None
+            if snapshot is not None:
+                try:
+                    self.compact(snapshot)
+                    self.log.close()
+                    self.log = open(self.path, 'a', encoding='utf-8')
+                    continue
+                except OSError as e:
+                    logger.error(f"Could not compact {self.path}, appending instead: {e}")
+            try:
+                self.log.write(''.join(lines))
+                self.log.flush()
+                os.fsync(self.log.fileno())
+                self.records += len(lines)
+            except OSError as e:
+                logger.error(f"Could not write {len(lines)} journal records: {e}")
+
+    def close(self):
+        """Write out whatever is still queued and stop the writer thread"""
+        with self.lock:
+            self.closed = True
+            self.wake.notify_all()
+        self.writer.join()
+        self.log.close()
+
+    def start(self, job_id: str, job: Dict[str, Any]):
+        job = dict(job, status='running', started=time.time())
+        with self.lock:
+            self.jobs[job_id] = job
+            self.append({'op': 'start', 'id': job_id, 'job': job})
+
+    def update(self, job_id: str, **fields):
+        with self.lock:
+            if job_id not in self.jobs:
+                return
+            self.jobs[job_id].update(fields)
+            self.append({'op': 'update', 'id': job_id, 'fields': fields})
+
+    def finish(self, job_id: str):
+        with self.lock:
+            if self.jobs.pop(job_id, None) is not None:
+                self.append({'op': 'finish', 'id': job_id})
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [dict(job, id=job_id) for job_id, job in self.jobs.items()]
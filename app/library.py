@@ -0,0 +1,125 @@
+"""
+Index of downloaded source media
+Every finished download records its source file and info dict. A later
+request for the same media with different post-processing options can then
+rerun the post-processor chain on the file already on disk instead of
+downloading it again
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from yt_dlp.utils import make_archive_id
+
+logger = logging.getLogger(__name__)
+
+
+def info_archive_id(info: Dict[str, Any]) -> Optional[str]:
+    extractor = info.get('extractor_key') or info.get('ie_key')
+    if not extractor or not info.get('id'):
+        return None
+    return make_archive_id(extractor, info['id'])
+
+
+class MediaIndex:
+    """Persistent map from media (by archive ID and URL) to its source file and info.json sidecar"""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        base_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = base_dir / 'index.json'
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.urls: Dict[str, str] = {}
+        if self.index_file.exists():
+            try:
+                with open(self.index_file, 'r') as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.error(f"Could not load media index from {self.index_file}: {e}")
+        for archive_id, entry in self.entries.items():
+            for url in entry['urls']:
+                self.urls[url] = archive_id
+
+    def save(self):
+        tmp_file = self.index_file.with_suffix('.tmp')
+        with self.lock:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            tmp_file.replace(self.index_file)
+
+    def add_entry(self, archive_id: str, source: str, info_json: str, urls: List[str],
+                  format_id: str = None, requested_format: str = None) -> Dict[str, Any]:
+        entry = {
+            'archive_id': archive_id,
+            'source': source,
+            'info_json': info_json,
+            'format_id': format_id,
+            'requested_format': requested_format,
+            'urls': sorted(set(url for url in urls if url)),
+            'recorded': time.time(),
+        }
+        with self.lock:
+            self.entries[archive_id] = entry
+            for url in entry['urls']:
+                self.urls[url] = archive_id
+        return entry
+
+    def record(self, source: str, info: Dict[str, Any], urls: List[str], requested_format: str = None) -> Optional[Dict[str, Any]]:
+        """Remember a downloaded source file, info must already be sanitized for JSON"""
+        archive_id = info_archive_id(info)
+        if archive_id is None:
+            return None
+        sidecar = self.base_dir / (re.sub(r'[^\w.-]', '_', archive_id) + '.info.json')
+        with open(sidecar, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        entry = self.add_entry(archive_id, source, str(sidecar), urls + [info.get('webpage_url')],
+                               info.get('format_id'), requested_format)
+        self.save()
+        return entry
+
+    def scan(self, directory: Path) -> int:
+        """Pick up --write-info-json sidecars next to downloads that are not indexed yet"""
+        added = 0
+        for sidecar in directory.rglob('*.info.json'):
+            try:
+                with open(sidecar, 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+            except Exception:
+                continue
+            archive_id = info_archive_id(info)
+            if archive_id is None or archive_id in self.entries or info.get('_type', 'video') != 'video':
+                continue
+            # yt-dlp names the sidecar after the media file, swapping the extension for .info.json
+            source = sidecar.with_name(sidecar.name[:-len('.info.json')] + f".{info.get('ext')}")
+            if not source.exists():
+                continue
+            self.add_entry(archive_id, str(source), str(sidecar), [info.get('webpage_url')], info.get('format_id'))
+            added += 1
+        if added:
+            self.save()
+            logger.info(f"Indexed {added} downloads from info.json sidecars in {directory}")
+        return added
+
+    def lookup(self, url: str, archive_id: str = None, requested_format: str = None) -> Optional[Dict[str, Any]]:
+        """Entry for the media behind url whose source file is still on disk"""
+        entry = self.entries.get(archive_id) if archive_id else None
+        if entry is None and url in self.urls:
+            entry = self.entries.get(self.urls[url])
+        if entry is None or not Path(entry['source']).exists():
+            return None
+        # A specific format request only reuses a source downloaded in that format
+        if requested_format and requested_format not in (entry['requested_format'], entry['format_id']):
+            return None
+        if not requested_format and entry['requested_format']:
+            return None
+        return entry
+
+    def load_info(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        with open(entry['info_json'], 'r', encoding='utf-8') as f:
+            return json.load(f)
@@ -1,20 +1,64 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Form, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Form, Request, HTTPException, Query
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import asyncio
 import json
 import os
 from pathlib import Path
 import yt_dlp
+from yt_dlp.utils import parse_bytes
 from typing import Dict, Any
 import uuid
 import logging
+import time
+from contextlib import asynccontextmanager
 from .options import convert_to_ydl_opts, get_options_by_category, YT_DLP_OPTIONS, OptionType, OptionCategory
+from .subscriptions import SubscriptionManager
+from .archive import ArchiveRegistry, url_archive_id
+from .search import stream_search, stream_multi_search, parse_multi_search
+from .formats import FormatTable, estimate_size, parse_size_limit, parse_sort
+from .tracing import traces, TraceHooks
+from .watchdog import watchdog
+from .postprocess import (PipelinedYoutubeDL, InvalidOptions, apply_postprocessing_params, postprocessing_params,
+                          rerun_postprocessing)
+from .library import MediaIndex
+from .control import job_control, JobInterrupted, JobCancelled, JobPaused, JobSuspended, CANCEL, PAUSE, SUSPEND
+from .journal import JobJournal
+from .bandwidth import bandwidth
+from .diskspace import DiskSpace
+from .staging import Stager, configured_scratch
+from .fragments import fragment_budget, fragment_params
+from .concurrency import download_slots, is_congestion_error, JOB_CLASSES, CLIENT_HEADER, CLIENT_MAX_QUEUED
+from .hosts import host_gate, is_throttled, HOST_RETRIES
+from .executors import extraction_executor, download_executor, postprocess_executor, executors, shutdown_executors
+from .metrics import (registry, Gauge, BYTES_DOWNLOADED, EXTRACTION_SECONDS, PROGRESS_EMITTED,
+                      PROGRESS_DROPPED, BROADCAST_MESSAGES, DOWNLOADS_FINISHED)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="yt-dlp-co2", description="Modern web interface for yt-dlp")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sync_task = asyncio.create_task(subscriptions.run_forever())
+    watchdog_task = asyncio.create_task(watchdog.run())
+    slots_task = asyncio.create_task(download_slots.run())
+    asyncio.get_running_loop().run_in_executor(extraction_executor, library.scan, DOWNLOAD_DIR)
+    recover_jobs()
+    stager.sweep(set(journal.jobs))
+    yield
+    sync_task.cancel()
+    watchdog_task.cancel()
+    slots_task.cancel()
+    # Unwind running downloads so they stay journaled and resume from their partial files after restart
+    for download_id in list(running_jobs):
+        job_control.request(download_id, SUSPEND)
+        download_slots.interrupt(download_id, JobSuspended())
+    shutdown_executors()
+    if running_jobs:
+        await asyncio.wait(list(running_jobs.values()), timeout=SHUTDOWN_GRACE)
+    journal.close()
+
+app = FastAPI(title="yt-dlp-co2", description="Modern web interface for yt-dlp", lifespan=lifespan)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -22,14 +66,43 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 HTML_FILE = Path("index.html")
 active_downloads: Dict[str, Dict[str, Any]] = {}
 connected_websockets = []
-DOWNLOAD_DIR = Path("/app/downloads")
+DOWNLOAD_DIR = Path(os.environ.get("DOWNLOAD_DIR", "/app/downloads"))
 DOWNLOAD_DIR.mkdir(exist_ok=True)
+STATE_DIR = Path(os.environ.get("STATE_DIR", "/app/state"))
+STATE_DIR.mkdir(exist_ok=True)
+archives = ArchiveRegistry(STATE_DIR / "archives")
+library = MediaIndex(STATE_DIR / "library")
+journal = JobJournal(STATE_DIR / "jobs.journal")
+stager = Stager(configured_scratch(), DOWNLOAD_DIR)
+disk_space = DiskSpace(DOWNLOAD_DIR)
+# When staging, transfers and post-processing need room on scratch, the download volume only the finished files
+scratch_space = DiskSpace(stager.scratch) if stager.enabled else None
+work_space = scratch_space or disk_space
+running_jobs: Dict[str, asyncio.Task] = {}
+FINAL_STATUSES = {'completed', 'error', 'skipped', 'cancelled'}
+SHUTDOWN_GRACE = 10  # seconds running downloads get to unwind on shutdown
 
 class WebSocketProgressHook:
     def __init__(self, download_id: str):
         self.download_id = download_id
+        self.bytes_seen = {}
         
     def __call__(self, d):
+        # Cancel and pause requests take effect here, on the download thread
+        job_control.check(self.download_id)
+        
+        # Count only the bytes received since the previous event for this file
+        downloaded = d.get('downloaded_bytes')
+        if downloaded is not None:
+            previous = self.bytes_seen.get(d.get('filename'), 0)
+            if downloaded > previous:
+                BYTES_DOWNLOADED.inc(downloaded - previous)
+                # Sleeping here holds back the downloader's next read, which throttles the transfer
+                bandwidth.consume(self.download_id, downloaded - previous)
+                work_space.written(self.download_id, downloaded - previous)
+                download_slots.first_bytes(self.download_id)
+            self.bytes_seen[d.get('filename')] = downloaded
+            
         if d['status'] == 'downloading':
             progress_data = {
                 'download_id': self.download_id,
@@ -55,6 +128,11 @@ class WebSocketProgressHook:
         download_id = self.download_id
         if download_id not in active_downloads:
             active_downloads[download_id] = {}
+        if 'progress' in active_downloads[download_id]:
+            PROGRESS_DROPPED.inc()
+        PROGRESS_EMITTED.inc(status=progress_data['status'])
+        active_downloads[download_id]['speed'] = d.get('speed') if d['status'] == 'downloading' else None
+        active_downloads[download_id]['eta_seconds'] = d.get('eta') if d['status'] == 'downloading' else None
         active_downloads[download_id]['progress'] = progress_data
 
 async def broadcast_progress(data):
@@ -64,7 +142,9 @@ async def broadcast_progress(data):
         for websocket in connected_websockets:
             try:
                 await websocket.send_text(message)
+                BROADCAST_MESSAGES.inc(result='sent')
             except:
+                BROADCAST_MESSAGES.inc(result='failed')
                 disconnected.append(websocket)
         
         for ws in disconnected:
@@ -80,6 +160,16 @@ async def download_video(request: Request):
     url = form_data.get("url")
     format_id = form_data.get("format_id")
     batch_file = form_data.get("batchfile")
+    client = client_identity(request)
+    if CLIENT_MAX_QUEUED and queued_jobs(client) >= CLIENT_MAX_QUEUED:
+        return HTMLResponse(content=f"<div class='error-neon card p-3 mb-3'>Too many queued downloads ({CLIENT_MAX_QUEUED}), "
+                                    f"wait for some to start</div>", status_code=429)
+    try:
+        # Reject bad post-processing options now rather than failing the job later
+        postprocessing_params(convert_to_ydl_opts({k: v for k, v in form_data.items() if k != "batchfile" and v}))
+    except InvalidOptions as e:
+        safe_error = str(e).replace('<', '&lt;').replace('>', '&gt;')
+        return HTMLResponse(content=f"<div class='error-neon card p-3 mb-3'>Invalid options: {safe_error}</div>", status_code=400)
     
     # Handle batch file upload
     if batch_file and hasattr(batch_file, 'read'):
@@ -92,11 +182,12 @@ async def download_video(request: Request):
                 
             # Process batch download
             download_id = str(uuid.uuid4())
-            asyncio.create_task(perform_batch_download(download_id, urls, format_id, 
-                                                     {k: v for k, v in form_data.items() if k not in ["batchfile", "format_id"] and v}))
+            start_job(download_id, perform_batch_download(download_id, urls, format_id, 
+                                                     {k: v for k, v in form_data.items() if k not in ["batchfile", "format_id"] and v},
+                                                     client=client))
             
             html_response = f'''<div id="download-{download_id}" class="card p-4 mb-4 relative">
-                <button onclick="this.parentElement.remove()" class="close-btn absolute top-2 right-2 text-gray-400 hover:text-white opacity-0 transition-opacity">
+                <button onclick="fetch('/downloads/{download_id}/cancel', {{method: 'POST'}}); this.parentElement.remove()" class="close-btn absolute top-2 right-2 text-gray-400 hover:text-white opacity-0 transition-opacity">
                     <svg class="h-4 w-4" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                         <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M6 18L18 6M6 6l12 12"></path>
                     </svg>
@@ -134,7 +225,7 @@ async def download_video(request: Request):
     
     try:
         logger.info(f"Creating download task for {download_id}")
-        task = asyncio.create_task(perform_download(download_id, url, format_id, options_dict))
+        task = start_job(download_id, perform_download(download_id, url, format_id, options_dict, client=client))
         logger.info(f"Download task created successfully for {download_id}")
     except Exception as e:
         logger.error(f"Failed to create download task: {e}")
@@ -145,7 +236,7 @@ async def download_video(request: Request):
     options_text = f" ({options_count} options)" if options_count > 0 else ""
     
     html_response = f'''<div id="download-{download_id}" class="card p-4 mb-4 relative">
-    <button onclick="this.parentElement.remove()" class="close-btn absolute top-2 right-2 text-gray-400 hover:text-white opacity-0 transition-opacity">
+    <button onclick="fetch('/downloads/{download_id}/cancel', {{method: 'POST'}}); this.parentElement.remove()" class="close-btn absolute top-2 right-2 text-gray-400 hover:text-white opacity-0 transition-opacity">
         <svg class="h-4 w-4" fill="none" stroke="currentColor" viewBox="0 0 24 24">
             <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M6 18L18 6M6 6l12 12"></path>
         </svg>
@@ -164,6 +255,16 @@ async def download_video(request: Request):
     
     return HTMLResponse(content=html_response)
 
+def client_identity(request: Request) -> str:
+    """Who submitted a job: its API key or client ID header, else the client address"""
+    key = request.headers.get(CLIENT_HEADER)
+    if key:
+        return key.strip()[:100]
+    return request.client.host if request.client else 'local'
+
+def queued_jobs(client: str) -> int:
+    return sum(1 for job in list(active_downloads.values()) if job.get('client') == client and job['status'] == 'queued')
+
 def get_quality_string(format_info):
     """Generate human-readable quality string like the UI formats endpoint"""
     if format_info.get('height'):
@@ -173,7 +274,41 @@ def get_quality_string(format_info):
     else:
         return "unknown"
 
-async def perform_download(download_id: str, url: str, format_id: str = None, options_dict: Dict[str, Any] = None):
+async def reprocess_existing(download_id: str, url: str, format_id: str, options_dict: Dict[str, Any], trace) -> bool:
+    """Rerun post-processing on an indexed source download, returns False when there is none"""
+    archive_id = await asyncio.get_event_loop().run_in_executor(extraction_executor, url_archive_id, url)
+    entry = library.lookup(url, archive_id, format_id)
+    if entry is None:
+        return False
+    
+    ydl_opts = {'progress_hooks': [WebSocketProgressHook(download_id)]}
+    user_opts = convert_to_ydl_opts(options_dict)
+    ydl_opts.update(user_opts)
+    apply_postprocessing_params(ydl_opts, user_opts)
+    archives.for_options(ydl_opts)
+    
+    active_downloads[download_id] = {
+        'url': url,
+        'status': 'postprocessing',
+        'format_id': format_id,
+        'options': options_dict
+    }
+    logger.info(f"Reprocessing {entry['source']} for {download_id} with options: {list(user_opts.keys())}")
+    with trace.span('reprocess', source=entry['source']):
+        info = library.load_info(entry)
+        await asyncio.get_event_loop().run_in_executor(postprocess_executor, rerun_postprocessing, ydl_opts, entry, info)
+    active_downloads[download_id]['status'] = 'completed'
+    DOWNLOADS_FINISHED.inc(status='completed')
+    return True
+
+async def perform_download(download_id: str, url: str, format_id: str = None, options_dict: Dict[str, Any] = None,
+                           output_path: str = None, job_class: str = 'interactive', client: str = 'local'):
+    trace = traces.create(download_id)
+    active_downloads[download_id] = {'url': url, 'status': 'queued', 'format_id': format_id, 'options': options_dict or {},
+                                     'job_class': job_class, 'client': client}
+    journal.start(download_id, {'kind': 'single', 'url': url, 'format_id': format_id, 'options': options_dict or {},
+                                'ydl_opts': convert_to_ydl_opts(options_dict) if options_dict else {},
+                                'output': output_path, 'job_class': job_class, 'client': client})
     try:
         # Extract video info once for all checks
         info_opts = {
@@ -183,6 +318,7 @@ async def perform_download(download_id: str, url: str, format_id: str = None, op
         
         info = None
         expected_path = None
+        size_estimate = None
         
         try:
             # First get video info to generate human-readable filename
@@ -200,8 +336,42 @@ async def perform_download(download_id: str, url: str, format_id: str = None, op
                 user_opts = convert_to_ydl_opts(options_dict)
                 info_opts.update(user_opts)
             
+            # Media already on disk only needs the requested post-processors rerun, no transfer
+            if options_dict and postprocessing_params(user_opts):
+                if await reprocess_existing(download_id, url, format_id, options_dict, trace):
+                    return
+            
+            # Consult the shared archive before spending an extraction on it
+            archive = archives.for_options(info_opts)
+            if archive is not None:
+                archive_id = await asyncio.get_event_loop().run_in_executor(extraction_executor, url_archive_id, url)
+                if archive_id in archive:
+                    active_downloads[download_id] = {
+                        'url': url,
+                        'status': 'skipped',
+                        'format_id': None,
+                        'options': {}
+                    }
+                    await broadcast_progress({
+                        'download_id': download_id,
+                        'status': 'completed',
+                        'message': 'Already in download archive',
+                        'filename': archive_id
+                    })
+                    logger.info(f"Skipped archived download {download_id}: {archive_id}")
+                    DOWNLOADS_FINISHED.inc(status='skipped')
+                    return
+            
             with yt_dlp.YoutubeDL(info_opts) as ydl:
-                info = await asyncio.get_event_loop().run_in_executor(None, ydl.extract_info, url, False)
+                extraction_started = time.monotonic()
+                with trace.span('probe', url=url):
+                    # Waits here while the site is backing off, before the job takes a download slot
+                    async with host_gate.request(url):
+                        info = await asyncio.get_event_loop().run_in_executor(extraction_executor, ydl.extract_info, url, False)
+                EXTRACTION_SECONDS.observe(time.monotonic() - extraction_started,
+                                           extractor=info.get('extractor_key', 'unknown'))
+                # Lets the scheduler run short downloads ahead of long ones
+                size_estimate = estimate_size(info)
                 
                 # Find the selected format to get quality info
                 selected_format = None
@@ -246,20 +416,28 @@ async def perform_download(download_id: str, url: str, format_id: str = None, op
                 }
                 await broadcast_progress(skip_data)
                 logger.info(f"Detected duplicate download {download_id}: {file_found.name}")
+                DOWNLOADS_FINISHED.inc(status='skipped')
                 return
                     
         except Exception as e:
             # If we can't check, proceed with download
             logger.warning(f"Could not check for existing files: {str(e)}")
         
+        if output_path:
+            # Recovered jobs keep their journaled file name so yt-dlp finds the partial files
+            expected_path = Path(output_path)
+        
         # Use the same human-readable filename for the actual download
         human_readable_template = str(expected_path) if expected_path else str(DOWNLOAD_DIR / '%(title)s [%(format_id)s].%(ext)s')
+        journal.update(download_id, output=human_readable_template)
         
         # Base options
         ydl_opts = {
             'outtmpl': human_readable_template,
             'progress_hooks': [WebSocketProgressHook(download_id)],
             'no_overwrites': True,  # This will help us detect duplicates
+            'continuedl': True,  # pick up .part files left by a pause or restart
+            **bandwidth.download_params(),
         }
         
         # Add format if specified
@@ -270,28 +448,63 @@ async def perform_download(download_id: str, url: str, format_id: str = None, op
         if options_dict:
             user_opts = convert_to_ydl_opts(options_dict)
             ydl_opts.update(user_opts)
+            apply_postprocessing_params(ydl_opts, user_opts)
+            archives.for_options(ydl_opts)
             logger.info(f"Download {download_id} using options: {list(user_opts.keys())}")
-            
+        ydl_opts.update(fragment_params(download_id, options_dict or {}))
+        ydl_opts['outtmpl'] = stager.template(ydl_opts['outtmpl'], download_id)
+
+        # /priority may have moved the job while it was probed
+        job = active_downloads.get(download_id, {})
+        job_class, client = job.get('job_class', job_class), job.get('client', client)
         active_downloads[download_id] = {
             'url': url,
-            'status': 'downloading',
+            'status': 'queued',
             'format_id': format_id,
-            'options': options_dict or {}
+            'options': options_dict or {},
+            'output': human_readable_template,
+            'job_class': job_class,
+            'client': client,
+            'size_estimate': size_estimate
         }
         
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with PipelinedYoutubeDL(ydl_opts, media_index=library, requested_format=format_id,
+                                final_path=lambda path: stager.final_path(path, download_id)) as ydl:
             try:
-                result = await asyncio.get_event_loop().run_in_executor(None, ydl.download, [url])
+                with trace.span('download', url=url) as download_span:
+                    def transfer_started():
+                        TraceHooks(trace, download_span).attach(ydl)
+                        bandwidth.register(download_id, job_class)
+                    
+                    result = await run_transfer(download_id, url, ydl, transfer_started)
+                    # Post-processing moves no bytes, hand the share to the other transfers
+                    bandwidth.unregister(download_id)
+                    # The download slot is free again, ffmpeg work continues on the post-processing pool
+                    if ydl.pending:
+                        active_downloads[download_id]['status'] = 'postprocessing'
+                        await ydl.wait_postprocessing()
+                    if stager.enabled:
+                        # Finished files leave scratch for the download volume on the move pool
+                        active_downloads[download_id]['status'] = 'moving'
+                        with trace.span('move'):
+                            await stager.move(download_id)
+                        disk_space.release(download_id)
                         
+            except JobInterrupted:
+                raise
             except Exception as download_error:
                 logger.error(f"Download failed for {download_id}: {download_error}")
                 raise download_error
             
         active_downloads[download_id]['status'] = 'completed'
+        DOWNLOADS_FINISHED.inc(status='completed')
         
+    except JobInterrupted as e:
+        await interrupt_job(download_id, e)
     except Exception as e:
         logger.error(f"Download error for {download_id}: {e}")
+        DOWNLOADS_FINISHED.inc(status='error')
         # Ensure the download entry exists before setting error status
         if download_id not in active_downloads:
             active_downloads[download_id] = {'url': url, 'status': 'error', 'format_id': format_id, 'options': options_dict or {}}
@@ -305,19 +518,99 @@ async def perform_download(download_id: str, url: str, format_id: str = None, op
             'error': str(e)
         }
         await broadcast_progress(error_data)
+    finally:
+        settle_job(download_id)
+
+async def stop_postprocessing(tasks: list):
+    """Cancel a batch's item post-processing and wait until none of it touches the item files any more"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
-async def perform_batch_download(download_id: str, urls: list, format_id: str = None, options_dict: Dict[str, Any] = None):
+async def perform_batch_download(download_id: str, urls: list, format_id: str = None, options_dict: Dict[str, Any] = None,
+                                 job_class: str = 'batch', client: str = 'local'):
     """Process batch download of multiple URLs"""
+    trace = traces.create(download_id)
+    # Batches journal a cursor into urls plus the items started but not finished, never the remaining list itself
+    active_downloads[download_id] = {'url': 'batch', 'status': 'downloading', 'format_id': format_id,
+                                     'options': options_dict or {}, 'urls': urls, 'cursor': 0, 'pending': [],
+                                     'job_class': job_class, 'client': client}
+    journal.start(download_id, {'kind': 'batch', 'urls': urls, 'format_id': format_id, 'options': options_dict or {},
+                                'ydl_opts': convert_to_ydl_opts(options_dict) if options_dict else {},
+                                'job_class': job_class, 'client': client})
+    postprocessing = []
     try:
+        skipped = 0
+        archive = archives.for_options(convert_to_ydl_opts(options_dict)) if options_dict else None
+        if archive is not None:
+            # Drop URLs already in the shared archive before any of them is scheduled
+            new_urls = await asyncio.get_event_loop().run_in_executor(extraction_executor, archive.filter_urls, urls)
+            skipped = len(urls) - len(new_urls)
+            urls = new_urls
+            if skipped:
+                active_downloads[download_id]['urls'] = urls
+                journal.update(download_id, urls=urls)
+            
         total_urls = len(urls)
         completed = 0
+        pending = active_downloads[download_id]['pending']
+        bandwidth.register(download_id, active_downloads[download_id]['job_class'])
+
+        def item_done(url: str):
+            """Drop a finished or failed item from what a resume has to redo"""
+            pending.remove(url)
+            journal.update(download_id, pending=list(pending))
+        
+        async def finish_item(ydl, item_span, url: str, i: int) -> bool:
+            """Wait for an item's post-processing while later items download"""
+            settled, moving = True, None
+            try:
+                await ydl.wait_postprocessing()
+                # A move that started runs to the end even if the batch is interrupted
+                moving = asyncio.ensure_future(stager.move(download_id, url))
+                await asyncio.shield(moving)
+                logger.info(f"Batch download {download_id}: completed {url}")
+                return True
+            except asyncio.CancelledError:
+                if moving is None:
+                    # The batch was interrupted, the item stays pending so a resume redoes it
+                    settled = False
+                    await ydl.cancel_postprocessing()
+                else:
+                    await moving
+                raise
+            except Exception as e:
+                item_span['attributes']['error'] = str(e)
+                logger.error(f"Batch download {download_id}: error with {url}: {e}")
+                await broadcast_progress({
+                    'download_id': download_id,
+                    'status': 'warning',
+                    'message': f'Failed URL {i}/{total_urls}: {str(e)[:100]}'
+                })
+                return False
+            finally:
+                if settled:
+                    item_done(url)
+                disk_space.release(f'{download_id}/{url}')
+                trace.finish(item_span)
+                ydl.close()
         
+        batch_started = time.monotonic()
         for i, url in enumerate(urls, 1):
+            if i > 1:
+                # Time per item so far projects the rest of the batch, post-processing overlaps the transfers
+                active_downloads[download_id]['batch_eta'] = (time.monotonic() - batch_started) / (i - 1) * (total_urls - i + 1)
+            # A resume redoes pending items, this URL included until its post-processing is done, then urls[cursor:]
+            pending.append(url)
+            active_downloads[download_id]['cursor'] = i
+            journal.update(download_id, cursor=i, pending=list(pending))
             try:
+                job_control.check(download_id)
                 # Base options
                 ydl_opts = {
                     'outtmpl': str(DOWNLOAD_DIR / '%(title)s [%(format_id)s].%(ext)s'),
                     'progress_hooks': [WebSocketProgressHook(download_id)],
+                    **bandwidth.download_params(),
                 }
                 
                 # Add format if specified
@@ -328,23 +621,37 @@ async def perform_batch_download(download_id: str, urls: list, format_id: str =
                 if options_dict:
                     user_opts = convert_to_ydl_opts(options_dict)
                     ydl_opts.update(user_opts)
+                    apply_postprocessing_params(ydl_opts, user_opts)
+                    archives.for_options(ydl_opts)
+                ydl_opts.update(fragment_params(download_id, options_dict or {}))
+                ydl_opts['outtmpl'] = stager.template(ydl_opts['outtmpl'], download_id, url)
                     
                 # Update progress
                 progress_data = {
                     'download_id': download_id,
                     'status': 'downloading',
                     'message': f'Processing URL {i}/{total_urls}: {url[:50]}...',
-                    'batch_progress': f'{completed}/{total_urls}'
+                    'batch_progress': f'{completed}/{total_urls}',
+                    'batch_eta': active_downloads[download_id].get('batch_eta')
                 }
                 await broadcast_progress(progress_data)
                 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    await asyncio.get_event_loop().run_in_executor(None, ydl.download, [url])
-                    
-                completed += 1
-                logger.info(f"Batch download {download_id}: completed {url}")
+                ydl = PipelinedYoutubeDL(ydl_opts, media_index=library, requested_format=format_id,
+                                         final_path=lambda path, url=url: stager.final_path(path, download_id, url))
+                item_span = trace.begin('item', url=url, index=i)
+                try:
+                    TraceHooks(trace, item_span).attach(ydl)
+                    await run_transfer(download_id, url, ydl, item=url)
+                except Exception as e:
+                    trace.finish(item_span, error=str(e))
+                    ydl.close()
+                    raise
+                postprocessing.append(asyncio.create_task(finish_item(ydl, item_span, url, i)))
                 
+            except JobInterrupted:
+                raise
             except Exception as e:
+                item_done(url)
                 logger.error(f"Batch download {download_id}: error with {url}: {e}")
                 error_data = {
                     'download_id': download_id,
@@ -354,17 +661,26 @@ async def perform_batch_download(download_id: str, urls: list, format_id: str =
                 await broadcast_progress(error_data)
                 continue
                 
+        bandwidth.unregister(download_id)
+        completed += sum(await asyncio.gather(*postprocessing))
+        
         # Final completion status
         active_downloads[download_id]['status'] = 'completed'
+        DOWNLOADS_FINISHED.inc(status='completed')
         completion_data = {
             'download_id': download_id,
             'status': 'completed',
-            'message': f'Batch completed: {completed}/{total_urls} successful'
+            'message': f'Batch completed: {completed}/{total_urls} successful' + (f', {skipped} already archived' if skipped else '')
         }
         await broadcast_progress(completion_data)
         
+    except JobInterrupted as e:
+        await stop_postprocessing(postprocessing)
+        await interrupt_job(download_id, e)
     except Exception as e:
+        await stop_postprocessing(postprocessing)
         logger.error(f"Batch download error for {download_id}: {e}")
+        DOWNLOADS_FINISHED.inc(status='error')
         # Ensure the download entry exists before setting error status
         if download_id not in active_downloads:
             active_downloads[download_id] = {'url': 'batch', 'status': 'error', 'format_id': format_id, 'options': options_dict or {}}
@@ -378,9 +694,93 @@ async def perform_batch_download(download_id: str, urls: list, format_id: str =
             'error': str(e)
         }
         await broadcast_progress(error_data)
+    finally:
+        settle_job(download_id)
+
+async def run_transfer(download_id: str, url: str, ydl, started=None, item: str = None) -> int:
+    """Run ydl.download in a download slot, paced per site and retried after a throttling back-off"""
+    # Hold the job until its output fits, before it takes a slot
+    size = active_downloads[download_id].get('size_estimate')
+    check = lambda: job_control.check(download_id)
+    await work_space.reserve(download_id, size, check)
+    if scratch_space is not None:
+        # The finished files need room on the download volume until the mover has published them
+        await disk_space.reserve(f'{download_id}/{item}' if item else download_id, size, check, headroom=1.0)
+    for attempt in range(1, HOST_RETRIES + 1):
+        try:
+            # Wait for the site before taking a slot, so a backing-off site holds no slots
+            async with host_gate.request(url) as site:
+                # The adaptive controller decides how many transfers run at once, the job's class its place in line
+                job = active_downloads[download_id]
+                async with download_slots.slot(download_id, job.get('job_class', 'interactive'), job.get('client', 'local'),
+                                               job.get('size_estimate')):
+                    active_downloads[download_id]['status'] = 'downloading'
+                    if started is not None:
+                        started()
+                        started = None
+                    job_control.check(download_id)
+                    result = await asyncio.get_event_loop().run_in_executor(download_executor, ydl.download, [url])
+            download_slots.record_success()
+            return result
+        except JobInterrupted:
+            raise
+        except Exception as e:
+            if is_congestion_error(e):
+                download_slots.record_error()
+            if attempt == HOST_RETRIES or not is_throttled(e):
+                raise
+            logger.warning(f"Download {download_id} throttled by {host_gate.keys.get(url, url)}, retrying after its back-off "
+                           f"({attempt}/{HOST_RETRIES})")
+            active_downloads[download_id]['status'] = 'queued'
+
+def settle_job(download_id: str):
+    """Drop finished jobs from the journal and remember which ones were paused"""
+    job_control.clear(download_id)
+    bandwidth.unregister(download_id)
+    fragment_budget.forget(download_id)
+    disk_space.release(download_id)
+    if scratch_space is not None:
+        scratch_space.release(download_id)
+    status = active_downloads[download_id]['status']
+    if status in FINAL_STATUSES:
+        journal.finish(download_id)
+        # Nothing can resume this job any more, publish what finished and drop its partial files from scratch
+        stager.settle(download_id)
+    elif status == 'paused':
+        journal.update(download_id, status='paused')
+
+async def interrupt_job(download_id: str, interruption: JobInterrupted):
+    """Mark a job paused or cancelled once its download thread has unwound"""
+    job = active_downloads[download_id]
+    job['speed'] = None
+    if isinstance(interruption, JobSuspended):
+        # Stays journaled as running, the next start picks it up again
+        job['status'] = 'suspended'
+        logger.info(f"Download {download_id} suspended for shutdown")
+        return
+    job['status'] = 'paused' if isinstance(interruption, JobPaused) else 'cancelled'
+    if job['status'] == 'cancelled':
+        DOWNLOADS_FINISHED.inc(status='cancelled')
+    # A staged job that is cancelled can never resume, so its partial files are dropped from scratch
+    kept = 'dropped from scratch' if stager.enabled and job['status'] == 'cancelled' else 'kept'
+    logger.info(f"Download {download_id} {job['status']}, partial files {kept}")
+    await broadcast_progress({
+        'download_id': download_id,
+        'status': job['status'],
+        'message': str(interruption)
+    })
 
 @app.get("/formats/{url:path}")
-async def get_formats(url: str):
+async def get_formats(url: str, vcodec: str = None, acodec: str = None, ext: str = None,
+                      min_height: int = None, max_height: int = None, min_tbr: float = None,
+                      max_tbr: float = None, max_filesize: str = None, sort: str = None,
+                      limit: int = Query(20, ge=1)):
+    """List formats filtered and ranked server-side, best first"""
+    try:
+        size_limit = parse_size_limit(max_filesize) if max_filesize else None
+        sort_keys = parse_sort(sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         ydl_opts = {
             'quiet': True,
@@ -388,31 +788,22 @@ async def get_formats(url: str):
         }
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+            # Interactive lookups fail fast instead of waiting out a site's back-off
+            async with host_gate.request(url, wait=False):
+                info = await asyncio.get_event_loop().run_in_executor(extraction_executor, ydl.extract_info, url, False)
             
-            formats = []
-            if 'formats' in info:
-                for f in info['formats']:
-                    if f.get('height'):
-                        quality = f"{f['height']}p"
-                    elif f.get('abr'):
-                        quality = f"{f['abr']}kbps"
-                    else:
-                        quality = "Unknown"
-                        
-                    formats.append({
-                        'format_id': f['format_id'],
-                        'ext': f.get('ext', 'unknown'),
-                        'quality': quality,
-                        'filesize': f.get('filesize'),
-                        'vcodec': f.get('vcodec', 'none'),
-                        'acodec': f.get('acodec', 'none')
-                    })
+            table = FormatTable(info.get('formats') or [])
+            indices = table.filter(vcodec=vcodec, acodec=acodec, ext=ext,
+                                   min_height=min_height, max_height=max_height,
+                                   min_tbr=min_tbr, max_tbr=max_tbr, max_filesize=size_limit)
+            ranked = table.sort(indices, sort_keys)
             
             return {
                 'title': info.get('title', 'Unknown'),
                 'duration': info.get('duration'),
-                'formats': formats[:20]
+                'total_formats': len(table),
+                'matched': len(ranked),
+                'formats': table.rows(ranked[:limit])
             }
             
     except Exception as e:
@@ -429,7 +820,8 @@ async def get_video_info(url: str, info_type: str = "basic"):
         }
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+            async with host_gate.request(url, wait=False):
+                info = await asyncio.get_event_loop().run_in_executor(extraction_executor, ydl.extract_info, url, False)
             
             if info_type == "formats":
                 formats = []
@@ -491,41 +883,137 @@ async def get_video_info(url: str, info_type: str = "basic"):
 async def search_videos(query: str, search_type: str = "ytsearch", max_results: int = 10):
     """Search for videos using yt-dlp search functionality"""
     try:
-        search_query = f"{search_type}{max_results}:{query}"
-        
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True  # Only get basic info, don't extract full details
+        results = [result async for result in stream_search(search_type, query, max_results)]
+        return {
+            'query': query,
+            'results': results,
+            'total': len(results)
         }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(search_query, download=False)
-            
-            results = []
-            if info and 'entries' in info:
-                for entry in info['entries']:
-                    if entry:
-                        results.append({
-                            'title': entry.get('title', 'Unknown'),
-                            'url': entry.get('url', ''),
-                            'id': entry.get('id', ''),
-                            'duration': entry.get('duration'),
-                            'uploader': entry.get('uploader', 'Unknown'),
-                            'view_count': entry.get('view_count'),
-                            'description': entry.get('description', '')
-                        })
-                        
-            return {
-                'query': query,
-                'results': results,
-                'total': len(results)
-            }
             
     except Exception as e:
         logger.error(f"Search error: {e}")
         return {'error': str(e)}
 
+@app.get("/search/stream/{query}")
+async def stream_search_videos(query: str, search_type: str = "ytsearch", max_results: int = 10, stream_format: str = "ndjson"):
+    """Stream search results as NDJSON lines (or SSE events) while they are extracted"""
+    def encode(data):
+        message = json.dumps(data)
+        return f"data: {message}\n\n" if stream_format == "sse" else message + "\n"
+        
+    async def generate():
+        total = 0
+        try:
+            async for result in stream_search(search_type, query, max_results):
+                total += 1
+                yield encode({'type': 'result', **result})
+            yield encode({'type': 'done', 'query': query, 'total': total})
+        except Exception as e:
+            logger.error(f"Search error: {e}")
+            yield encode({'type': 'error', 'error': str(e)})
+            
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type)
+
+@app.post("/search/multi")
+async def multi_search_videos(request: Request):
+    """Run many searches concurrently and stream merged, deduplicated results as NDJSON"""
+    try:
+        searches = parse_multi_search(await request.json())
+    except ValueError as e:
+        # Malformed JSON raises a ValueError too
+        raise HTTPException(status_code=400, detail=str(e))
+        
+    async def generate():
+        async for event in stream_multi_search(searches):
+            yield json.dumps(event) + "\n"
+            
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+def start_job(download_id: str, job) -> asyncio.Task:
+    """Run a job coroutine in the background, tracked so shutdown can suspend it"""
+    task = asyncio.create_task(job)
+    running_jobs[download_id] = task
+    task.add_done_callback(lambda t: running_jobs.pop(download_id, None) if running_jobs.get(download_id) is t else None)
+    return task
+
+def remaining_urls(job: Dict[str, Any]) -> list:
+    """URLs a batch still has to process: items started but not finished, then the ones never started"""
+    return list(job.get('pending') or []) + (job.get('urls') or [])[job.get('cursor', 0):]
+
+def recover_jobs():
+    """Requeue jobs a restart interrupted, paused ones wait for an explicit resume"""
+    for job in journal.unfinished():
+        download_id = job['id']
+        if job['status'] == 'paused':
+            active_downloads[download_id] = {'url': job.get('url', 'batch'), 'status': 'paused', 'format_id': job['format_id'],
+                                             'options': job['options'], 'urls': job.get('urls'), 'cursor': job.get('cursor', 0),
+                                             'pending': job.get('pending', []), 'output': job.get('output'),
+                                             'job_class': job.get('job_class'), 'client': job.get('client', 'local')}
+            continue
+        logger.info(f"Resuming interrupted {job['kind']} download {download_id}")
+        if job['kind'] == 'batch':
+            start_job(download_id, perform_batch_download(download_id, remaining_urls(job), job['format_id'], job['options'],
+                                                          job.get('job_class', 'batch'), job.get('client', 'local')))
+        else:
+            start_job(download_id, perform_download(download_id, job['url'], job['format_id'], job['options'], job.get('output'),
+                                                    job.get('job_class', 'interactive'), job.get('client', 'local')))
+
+def enqueue_download(url: str, format_id: str = None, options_dict: Dict[str, Any] = None) -> str:
+    """Schedule a single download in the background and return its id"""
+    download_id = str(uuid.uuid4())
+    start_job(download_id, perform_download(download_id, url, format_id, options_dict, job_class='subscription',
+                                            client='subscriptions'))
+    return download_id
+
+subscriptions = SubscriptionManager(STATE_DIR / "subscriptions.json", enqueue_download)
+
+@app.post("/subscriptions")
+async def add_subscription(request: Request):
+    """Subscribe to a channel or playlist that is synced incrementally"""
+    try:
+        form_data = await request.form()
+        url = form_data.get("url")
+        if not url:
+            return {"error": "URL is required", "success": False}
+            
+        interval = form_data.get("interval")
+        options_dict = {k: v for k, v in form_data.items() if k not in ["url", "format_id", "interval", "dateafter"] and v}
+        postprocessing_params(convert_to_ydl_opts(options_dict))
+        subscription = subscriptions.add(
+            url,
+            format_id=form_data.get("format_id") or None,
+            options=options_dict,
+            interval=int(interval) if interval else None,
+            dateafter=form_data.get("dateafter") or None
+        )
+        asyncio.create_task(subscriptions.sync(subscription['id']))
+        return {"subscription": subscription, "success": True}
+        
+    except Exception as e:
+        logger.error(f"Subscription add error: {e}")
+        return {"error": str(e), "success": False}
+
+@app.get("/subscriptions")
+async def list_subscriptions():
+    """List subscriptions with their sync state"""
+    return {"subscriptions": subscriptions.list_subscriptions(), "success": True}
+
+@app.delete("/subscriptions/{sub_id}")
+async def remove_subscription(sub_id: str):
+    """Stop syncing a subscription"""
+    if not subscriptions.remove(sub_id):
+        return {"error": f"Subscription {sub_id} not found", "success": False}
+    return {"success": True}
+
+@app.post("/subscriptions/{sub_id}/sync")
+async def sync_subscription(sub_id: str):
+    """Sync a subscription now and enqueue only its new entries"""
+    if sub_id not in subscriptions.subscriptions:
+        return {"error": f"Subscription {sub_id} not found", "success": False}
+    new_entries = await subscriptions.sync(sub_id)
+    return {"new_entries": new_entries, "success": True}
+
 @app.websocket("/ws/progress")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -547,6 +1035,172 @@ async def websocket_endpoint(websocket: WebSocket):
 async def list_downloads():
     return active_downloads
 
+@app.post("/downloads/{download_id}/cancel")
+async def cancel_download(download_id: str):
+    """Stop a job, its partial files stay on disk"""
+    job = active_downloads.get(download_id)
+    if job is None:
+        return {"error": f"Download {download_id} not found", "success": False}
+    if job['status'] == 'paused':
+        # Nothing is running, so the job can be cancelled right away
+        job['status'] = 'cancelled'
+        settle_job(download_id)
+        DOWNLOADS_FINISHED.inc(status='cancelled')
+        await broadcast_progress({'download_id': download_id, 'status': 'cancelled', 'message': 'Cancelled by user'})
+        return {"status": "cancelled", "success": True}
+    if job['status'] not in ('queued', 'downloading'):
+        return {"error": f"Download is {job['status']} and cannot be cancelled", "success": False}
+    job_control.request(download_id, CANCEL)
+    download_slots.interrupt(download_id, JobCancelled())
+    return {"status": "cancelling", "success": True}
+
+@app.post("/downloads/{download_id}/pause")
+async def pause_download(download_id: str):
+    """Stop a job at its next progress update and free its worker, keeping .part files for resume"""
+    job = active_downloads.get(download_id)
+    if job is None:
+        return {"error": f"Download {download_id} not found", "success": False}
+    if job['status'] not in ('queued', 'downloading'):
+        return {"error": f"Download is {job['status']} and cannot be paused", "success": False}
+    job_control.request(download_id, PAUSE)
+    download_slots.interrupt(download_id, JobPaused())
+    return {"status": "pausing", "success": True}
+
+@app.post("/downloads/{download_id}/priority")
+async def set_download_priority(download_id: str, request: Request):
+    """Move a job to another priority lane: interactive, batch or subscription"""
+    form_data = await request.form()
+    priority = str(form_data.get('priority', '')).strip()
+    job = active_downloads.get(download_id)
+    if job is None:
+        return {"error": f"Download {download_id} not found", "success": False}
+    if priority not in JOB_CLASSES:
+        return {"error": f"Unknown priority {priority}, expected one of {', '.join(JOB_CLASSES)}", "success": False}
+    if job['status'] in FINAL_STATUSES:
+        return {"error": f"Download is {job['status']}", "success": False}
+    job['job_class'] = priority
+    journal.update(download_id, job_class=priority)
+    # A queued job changes lanes now, a running one keeps its slot but its bandwidth share follows the class
+    requeued = download_slots.reprioritize(download_id, priority)
+    bandwidth.set_class(download_id, priority)
+    return {"priority": priority, "requeued": requeued, "success": True}
+
+@app.post("/downloads/{download_id}/resume")
+async def resume_download(download_id: str):
+    """Restart a paused job, yt-dlp continues from the partial files"""
+    job = active_downloads.get(download_id)
+    if job is None:
+        return {"error": f"Download {download_id} not found", "success": False}
+    if job['status'] != 'paused':
+        return {"error": f"Download is {job['status']}, only paused downloads can be resumed", "success": False}
+    job_control.clear(download_id)
+    if job['url'] == 'batch':
+        start_job(download_id, perform_batch_download(download_id, remaining_urls(job), job['format_id'], job['options'],
+                                                      job.get('job_class') or 'batch', job.get('client', 'local')))
+    else:
+        start_job(download_id, perform_download(download_id, job['url'], job['format_id'], job['options'],
+                                                job.get('output'), job.get('job_class') or 'interactive',
+                                                job.get('client', 'local')))
+    job['status'] = 'queued'
+    return {"status": "queued", "success": True}
+
+@app.get("/downloads/{download_id}/trace")
+async def get_download_trace(download_id: str, trace_format: str = "timeline"):
+    """Per-phase timing of a job, as a timeline or as OTLP JSON (trace_format=otlp)"""
+    trace = traces.get(download_id)
+    if trace is None:
+        return {"error": f"No trace for download {download_id}"}
+    return trace.to_otlp() if trace_format == "otlp" else trace.timeline()
+
+@app.get("/archives")
+async def list_archives():
+    """List the shared download archives loaded by the server"""
+    return {"archives": archives.list_archives(), "success": True}
+
+def job_status_counts():
+    counts = {}
+    for data in list(active_downloads.values()):
+        status = data.get('status', 'pending')
+        counts[(status,)] = counts.get((status,), 0) + 1
+    return counts
+
+registry.register(Gauge('ytdlp_co2_jobs', 'Tracked jobs by status', ('status',), function=job_status_counts))
+registry.register(Gauge('ytdlp_co2_download_speed_bytes', 'Aggregate speed of running downloads in bytes/s',
+                        function=lambda: sum(d.get('speed') or 0 for d in list(active_downloads.values()))))
+def volumes() -> Dict[str, DiskSpace]:
+    return {'downloads': disk_space, 'scratch': scratch_space} if scratch_space is not None else {'downloads': disk_space}
+
+registry.register(Gauge('ytdlp_co2_disk_free_bytes', 'Free space on the download and scratch volumes', ('volume',),
+                        function=lambda: {(name,): space.free() for name, space in volumes().items()}))
+registry.register(Gauge('ytdlp_co2_disk_reserved_bytes', 'Disk space reserved by running jobs and not yet written',
+                        ('volume',), function=lambda: {(name,): space.stats()['reserved'] for name, space in volumes().items()}))
+registry.register(Gauge('ytdlp_co2_disk_held_jobs', 'Jobs waiting for disk space', ('volume',),
+                        function=lambda: {(name,): len(space.held) for name, space in volumes().items()}))
+registry.register(Gauge('ytdlp_co2_websocket_clients', 'Connected progress WebSocket clients',
+                        function=lambda: len(connected_websockets)))
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of pipeline metrics"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/diagnostics/loop")
+async def loop_diagnostics():
+    """Event loop lag histogram and stacks of code that recently blocked the loop"""
+    return watchdog.diagnostics()
+
+@app.get("/diagnostics/executors")
+async def executor_diagnostics():
+    """Size, queue depth and utilization of each worker pool, the fragment budget and the adaptive download slots"""
+    stats = {name: executor.stats() for name, executor in executors.items()}
+    stats['fragments'] = fragment_budget.stats()
+    stats['download_slots'] = download_slots.stats()
+    return stats
+
+@app.get("/queue")
+async def queue_status():
+    """Queued downloads in scheduling order with projected start and completion, and when each lane drains"""
+    running = {download_id: job.get('eta_seconds') for download_id, job in list(active_downloads.items())
+               if job.get('status') == 'downloading' and download_slots.find(download_id)[1] is None}
+    projection = download_slots.projection(running)
+    projection['running'] = running
+    projection['batches'] = {download_id: {'remaining_urls': len(remaining_urls(job)), 'eta': job.get('batch_eta')}
+                             for download_id, job in list(active_downloads.items())
+                             if job.get('url') == 'batch' and job.get('status') == 'downloading'}
+    return projection
+
+@app.get("/disk")
+async def disk_status():
+    """Free space, reservations of running jobs and jobs held for space on the download and scratch volumes"""
+    return {name: space.stats() for name, space in volumes().items()}
+
+@app.get("/hosts")
+async def list_hosts():
+    """Per-site circuit breaker state: closed, open (backing off) or half_open (probing)"""
+    return {"hosts": host_gate.stats(), "success": True}
+
+@app.post("/hosts/{host}/reset")
+async def reset_host(host: str):
+    """End a site's back-off now and release its queued jobs"""
+    if not host_gate.reset(host):
+        return {"error": f"Unknown site {host}", "success": False}
+    return {"success": True}
+
+@app.get("/bandwidth")
+async def bandwidth_status():
+    """Server-wide bandwidth limit and the share each running job currently gets"""
+    return bandwidth.stats()
+
+@app.post("/bandwidth")
+async def set_bandwidth_limit(request: Request):
+    """Change the server-wide limit at runtime, e.g. limit=5M, 0 to disable"""
+    form_data = await request.form()
+    limit = parse_bytes(str(form_data.get("limit") or '0'))
+    if limit is None:
+        return {"error": f"Invalid limit: {form_data.get('limit')}", "success": False}
+    bandwidth.set_limit(limit)
+    return {"limit": limit, "success": True}
+
 @app.get("/options")
 async def get_options():
     """Return all available yt-dlp options organized by category"""
@@ -0,0 +1,144 @@
+"""
+Minimal Prometheus-style metrics for the download pipeline
+Metrics are updated from progress hooks and download tasks and rendered in
+the text exposition format by the /metrics endpoint
+"""
+
+import threading
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[Any, ...], extra: str = '') -> str:
+    pairs = [
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in zip(labelnames, labelvalues)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[Any, ...], float] = {}
+
+    def key(self, labels: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}'
+                    for key, value in self.values.items()]
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        return '\n'.join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge that is either set directly or computed by a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], Any]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def samples(self) -> List[str]:
+        if self.function is not None:
+            result = self.function()
+            # Callbacks return a plain number or a {label tuple: value} dict
+            values = result if isinstance(result, dict) else {(): result}
+            with self.lock:
+                self.values = {key if isinstance(key, tuple) else (key,): value for key, value in values.items()}
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.series: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            series = self.series.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, series in self.series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    le = format_labels(self.labelnames, key, f'le="{format_value(bound)}"')
+                    lines.append(f'{self.name}_bucket{le} {cumulative}')
+                labels = format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {format_value(series["sum"])}')
+                lines.append(f'{self.name}_count{labels} {series["count"]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+registry = Registry()
+
+BYTES_DOWNLOADED = registry.register(Counter(
+    'ytdlp_co2_downloaded_bytes_total', 'Bytes received by all downloads'))
+EXTRACTION_SECONDS = registry.register(Histogram(
+    'ytdlp_co2_extraction_seconds', 'Time spent extracting info before a download', ('extractor',)))
+PROGRESS_EMITTED = registry.register(Counter(
+    'ytdlp_co2_progress_events_total', 'Progress events produced by download hooks', ('status',)))
+PROGRESS_DROPPED = registry.register(Counter(
+    'ytdlp_co2_progress_events_dropped_total', 'Progress events overwritten before any client received them'))
+BROADCAST_MESSAGES = registry.register(Counter(
+    'ytdlp_co2_broadcast_messages_total', 'Messages pushed to WebSocket clients by broadcast_progress', ('result',)))
+DOWNLOADS_FINISHED = registry.register(Counter(
+    'ytdlp_co2_downloads_finished_total', 'Download jobs that reached a final state', ('status',)))
@@ -0,0 +1,202 @@
+"""
+Pipelined post-processing
+Downloads hand finished files to the post-processing pool instead of running
+ffmpeg (merging, audio extraction, recoding, embedding, SponsorBlock cuts) on
+the download thread, so the download slot is free for the next transfer.
+One YoutubeDL's files are post-processed one at a time, in order, since the
+instance is not thread-safe; separate instances run in parallel
+"""
+
+import asyncio
+import logging
+import optparse
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, List, Optional
+
+import yt_dlp
+
+from .executors import postprocess_executor
+from .library import MediaIndex
+from .options import YT_DLP_OPTIONS, OptionCategory
+
+logger = logging.getLogger(__name__)
+
+# Form options that only mean something to yt-dlp's command line parser and are safe to take from
+# anyone who can reach the form. Commands, ffmpeg arguments, binaries and metadata rewriting stay off
+POSTPROCESSING_OPTIONS = [
+    'extract_audio', 'audio_format', 'audio_quality', 'recode_video', 'keep_video', 'no_keep_video',
+    'no_post_overwrites', 'embed_subs', 'embed_thumbnail', 'embed_metadata', 'embed_chapters', 'embed_info_json',
+    'sponsorblock_mark', 'sponsorblock_remove', 'sponsorblock_chapter_title', 'no_sponsorblock', 'remove_chapters',
+]
+# Already valid YoutubeDL params that need no translation
+PASSTHROUGH_OPTIONS = ['fixup']
+REJECTED_OPTIONS = [
+    key for key, option in YT_DLP_OPTIONS.items()
+    if option['category'] in (OptionCategory.POST_PROCESSING, OptionCategory.SPONSORBLOCK)
+    and key not in POSTPROCESSING_OPTIONS + PASSTHROUGH_OPTIONS
+]
+# Categories that can only be marked, not cut out
+MARK_ONLY_CATEGORIES = {'poi_highlight'}
+DEFAULT_PARAMS = yt_dlp.parse_options([]).ydl_opts
+
+
+class InvalidOptions(ValueError):
+    """Post-processing options that are not allowed or that yt-dlp rejects"""
+
+
+def is_set(value) -> bool:
+    return value is not None and value is not False and value != [] and value != ''
+
+
+def postprocessing_params(user_opts: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate post-processing form options into YoutubeDL params, including the postprocessors chain"""
+    rejected = [key for key in REJECTED_OPTIONS if is_set(user_opts.get(key))]
+    if rejected:
+        raise InvalidOptions(f"Options not allowed: {', '.join(rejected)}")
+    argv = []
+    for key in POSTPROCESSING_OPTIONS:
+        value = user_opts.get(key)
+        if key == 'sponsorblock_remove' and is_set(value):
+            # The UI offers one category list for both, highlights can only be marked
+            value = [category for category in (value if isinstance(value, list) else str(value).split(','))
+                     if category.strip() not in MARK_ONLY_CATEGORIES]
+        if not is_set(value):
+            continue
+        flag = YT_DLP_OPTIONS[key]['cli'][-1]
+        if value is True:
+            argv.append(flag)
+        else:
+            argv += [flag, ','.join(value) if isinstance(value, list) else str(value)]
+    if not argv:
+        return {}
+
+    try:
+        params = yt_dlp.parse_options(argv).ydl_opts
+    except (optparse.OptParseError, ValueError) as e:
+        # The parser's message comes after its usage text, e.g. "invalid audio format "zzz" given"
+        raise InvalidOptions(str(e).strip().splitlines()[-1].split('error: ', 1)[-1]) from None
+    # Only keep what the options changed, the caller owns output templates
+    return {key: value for key, value in params.items()
+            if key != 'outtmpl' and DEFAULT_PARAMS.get(key) != value}
+
+
+def apply_postprocessing_params(ydl_opts: Dict[str, Any], user_opts: Dict[str, Any]):
+    """Merge translated post-processing params into ydl_opts without overriding an explicit format"""
+    for key, value in postprocessing_params(user_opts).items():
+        if key == 'format' and 'format' in ydl_opts:
+            continue
+        ydl_opts[key] = value
+
+
+class PipelinedYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that queues each downloaded file's post-processing on the post-processing pool"""
+
+    def __init__(self, params=None, auto_init=True, media_index: Optional[MediaIndex] = None,
+                 requested_format: str = None, final_path: Callable[[str], str] = None):
+        super().__init__(params, auto_init)
+        self.pending: List = []
+        # Files waiting for this instance's single post-processing run
+        self.queue = deque()
+        self.queue_lock = threading.Lock()
+        self.processing = False
+        self.media_index = media_index
+        self.requested_format = requested_format
+        # Maps a file written to the scratch directory to where it is published
+        self.final_path = final_path or (lambda path: path)
+
+    def process_info(self, info_dict):
+        super().process_info(info_dict)
+        # yt-dlp would archive the video once process_info returns, before its queued post-processing ran.
+        # deferred_post_process writes the entry instead, and only if every post-processor succeeded
+        if info_dict.get('__postprocessing_deferred') and not self.params.get('force_write_download_archive'):
+            info_dict['__write_download_archive'] = False
+
+    def post_process(self, filename, info, files_to_move=None):
+        # process_info keeps using info after this returns, so the pool works on a copy
+        info['filepath'] = filename
+        info['__postprocessing_deferred'] = True
+        future = Future()
+        self.pending.append(future)
+        with self.queue_lock:
+            self.queue.append((future, filename, dict(info), files_to_move))
+        self.schedule()
+        return info
+
+    def schedule(self):
+        """Start the next queued post-processing unless one of this instance's is already running"""
+        with self.queue_lock:
+            if self.processing or not self.queue:
+                return
+            self.processing = True
+            item = self.queue.popleft()
+        try:
+            postprocess_executor.submit(self.run_queued, *item)
+        except RuntimeError:
+            # The pool is shut down
+            item[0].cancel()
+            with self.queue_lock:
+                self.processing = False
+
+    def run_queued(self, future, filename, info, files_to_move):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self.deferred_post_process(filename, info, files_to_move))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            with self.queue_lock:
+                self.processing = False
+            self.schedule()
+
+    def deferred_post_process(self, filename, info, files_to_move):
+        source_info = self.sanitize_info(dict(info), remove_private_keys=True) if self.media_index else None
+        urls = [info.get('original_url')]
+        result = super().post_process(filename, info, files_to_move)
+        if not self.params.get('force_write_download_archive') and not self.in_download_archive(info):
+            self.record_download_archive(info)
+        # Destructive post-processors (e.g. audio extraction without keep_video) leave no source to reuse
+        if self.media_index is not None and os.path.exists(filename):
+            try:
+                self.media_index.record(self.final_path(filename), source_info, urls, self.requested_format)
+            except Exception as e:
+                logger.warning(f"Could not index {filename}: {e}")
+        return result
+
+    async def wait_postprocessing(self):
+        """Wait for queued post-processing, failing like an inline post-processor would"""
+        futures = list(self.pending)
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures), return_exceptions=True)
+        self.pending = [f for f in self.pending if f not in futures]
+        for result in results:
+            if isinstance(result, Exception):
+                self.report_error(f'Postprocessing: {result}')
+
+    async def cancel_postprocessing(self):
+        """Drop queued post-processing and wait for a step that already started, it cannot be stopped midway"""
+        for future in self.pending:
+            future.cancel()
+        running, self.pending = [f for f in self.pending if not f.done()], []
+        if running:
+            await asyncio.wait([asyncio.wrap_future(f) for f in running])
+
+    def close(self):
+        for future in self.pending:
+            future.cancel()
+        super().close()
+
+
+def rerun_postprocessing(ydl_opts: Dict[str, Any], entry: Dict[str, Any], info: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the requested post-processor chain on an indexed source file, without transferring any media"""
+    opts = dict(ydl_opts)
+    opts.update({
+        # The source already exists under this name, so yt-dlp skips straight to post-processing
+        'outtmpl': entry['source'].replace('%', '%%'),
+        'format': info.get('format_id'),
+        'keepvideo': True,  # keep the source around for later reruns
+    })
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.process_ie_result(info, download=True)
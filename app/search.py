@@ -0,0 +1,203 @@
+"""
+Streaming search with a short-lived result cache
+Entries are forwarded as yt-dlp produces them so large searches never block
+the event loop, and identical searches are answered from memory
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, AsyncIterator
+
+import yt_dlp
+from yt_dlp.postprocessor.common import PostProcessor
+
+from .executors import extraction_executor
+
+SEARCH_CACHE_TTL = 300  # seconds a search result stays fresh
+SEARCH_CACHE_SIZE = 256  # searches kept in memory
+
+
+def search_result(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Trim a flat search entry down to what the API returns"""
+    return {
+        'title': entry.get('title', 'Unknown'),
+        'url': entry.get('url', ''),
+        'id': entry.get('id', ''),
+        'duration': entry.get('duration'),
+        'uploader': entry.get('uploader', 'Unknown'),
+        'view_count': entry.get('view_count'),
+        'description': entry.get('description', '')
+    }
+
+
+class EntryForwarder(PostProcessor):
+    """Pre-process hook that hands every search entry to a callback as soon as it is seen"""
+
+    def __init__(self, callback: Callable[[Dict[str, Any]], None]):
+        super().__init__()
+        self.callback = callback
+
+    def run(self, info):
+        self.callback(search_result(info))
+        return [], info
+
+
+def run_search(search_query: str, callback: Callable[[Dict[str, Any]], None]):
+    """Blocking search that reports entries through callback while pages are fetched"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': True,  # Only get basic info, don't extract full details
+        'lazy_playlist': True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.add_post_processor(EntryForwarder(callback), when='pre_process')
+        ydl.extract_info(search_query, download=False)
+
+
+class SearchCache:
+    """Bounded TTL cache of complete search results"""
+
+    def __init__(self, ttl: int = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, key) -> Optional[List[Dict[str, Any]]]:
+        cached = self.entries.get(key)
+        if cached is None:
+            return None
+        expires, results = cached
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        return results
+
+    def put(self, key, results: List[Dict[str, Any]]):
+        self.entries[key] = (time.monotonic() + self.ttl, results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+search_cache = SearchCache()
+
+
+async def stream_search(search_type: str, query: str, max_results: int) -> AsyncIterator[Dict[str, Any]]:
+    """Yield search results as they are extracted, or straight from the cache"""
+    key = (search_type, query, max_results)
+    cached = search_cache.get(key)
+    if cached is not None:
+        for result in cached:
+            yield result
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    future = loop.run_in_executor(
+        extraction_executor, run_search, f"{search_type}{max_results}:{query}",
+        lambda result: loop.call_soon_threadsafe(queue.put_nowait, result)
+    )
+    # Done callbacks run on the loop after every entry callback already queued
+    future.add_done_callback(lambda f: queue.put_nowait(None))
+
+    results = []
+    while (result := await queue.get()) is not None:
+        results.append(result)
+        yield result
+
+    future.result()
+    search_cache.put(key, results)
+
+
+MULTI_SEARCH_CONCURRENCY = 8  # searches of one multi-query request running at once
+RANK_FUSION_K = 60  # reciprocal rank fusion damping constant
+
+
+def positive_int(value, name: str) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be a positive integer")
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a positive integer") from None
+    if number < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return number
+
+
+def parse_multi_search(body: Any) -> List[Dict[str, Any]]:
+    """Searches requested by a /search/multi body, ValueError if it is malformed"""
+    if not isinstance(body, dict):
+        raise ValueError("Body must be a JSON object")
+    search_types = body.get('search_types') or ['ytsearch']
+    if not isinstance(search_types, list) or not all(isinstance(t, str) and t for t in search_types):
+        raise ValueError("search_types must be a list of search prefixes")
+    max_results = positive_int(body.get('max_results', 10), 'max_results')
+    queries = body.get('queries')
+    if not isinstance(queries, list) or not queries:
+        raise ValueError("queries must be a non-empty list")
+
+    # Plain query strings run against every search type, objects pick their own
+    searches = []
+    for item in queries:
+        if isinstance(item, str) and item.strip():
+            searches.extend({'query': item, 'search_type': t, 'max_results': max_results} for t in search_types)
+        elif isinstance(item, dict) and isinstance(item.get('query'), str) and item['query'].strip():
+            search_type = item.get('search_type', 'ytsearch')
+            if not isinstance(search_type, str) or not search_type:
+                raise ValueError(f"Invalid search_type for query {item['query']!r}")
+            searches.append({
+                'query': item['query'],
+                'search_type': search_type,
+                'max_results': positive_int(item.get('max_results', max_results), 'max_results'),
+            })
+        else:
+            raise ValueError(f"Invalid query: {item!r}")
+    return searches
+
+
+async def stream_multi_search(searches: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """Run several searches concurrently, yielding each unique video once and then the fused ranking"""
+    queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(MULTI_SEARCH_CONCURRENCY)
+
+    async def run_one(index: int, search: Dict[str, Any]):
+        async with semaphore:
+            try:
+                position = 0
+                async for result in stream_search(search['search_type'], search['query'], search['max_results']):
+                    position += 1
+                    await queue.put(('result', index, position, result))
+            except Exception as e:
+                await queue.put(('error', index, 0, str(e)))
+        await queue.put(('finished', index, 0, None))
+
+    tasks = [asyncio.create_task(run_one(i, search)) for i, search in enumerate(searches)]
+    merged: Dict[str, Dict[str, Any]] = {}
+    pending = len(tasks)
+    try:
+        while pending:
+            kind, index, position, payload = await queue.get()
+            search = searches[index]
+            if kind == 'finished':
+                pending -= 1
+            elif kind == 'error':
+                yield {'type': 'error', 'query': search['query'], 'search_type': search['search_type'], 'error': payload}
+            else:
+                key = payload.get('id') or payload.get('url')
+                source = f"{search['search_type']}:{search['query']}"
+                score = 1 / (RANK_FUSION_K + position)
+                if key in merged:
+                    merged[key]['score'] += score
+                    merged[key]['sources'].append(source)
+                else:
+                    merged[key] = {**payload, 'score': score, 'sources': [source]}
+                    yield {'type': 'result', **payload, 'source': source}
+
+        ranked = sorted(merged.values(), key=lambda r: r['score'], reverse=True)
+        yield {'type': 'done', 'results': ranked, 'total': len(ranked)}
+    finally:
+        for task in tasks:
+            task.cancel()
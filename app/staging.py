@@ -0,0 +1,158 @@
+"""
+Scratch-to-final staging
+With SCRATCH_DIR set, downloads write their partial files, fragments, merges
+and post-processing output to a per-job directory on fast local scratch
+space instead of the download volume. Once a job (or a batch item) has
+finished post-processing, the move pool transfers its finished files to
+DOWNLOAD_DIR in one pass, so slow network or bind-mounted volumes only see
+whole-file writes. When a job ends for good, whatever finished media is
+still in scratch (e.g. after a failed post-processor) is published too, and
+only partial files are dropped
+"""
+
+import asyncio
+import glob
+import hashlib
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
+from .executors import move_executor
+from .metrics import registry, Counter
+
+logger = logging.getLogger(__name__)
+
+ITEM_PREFIX = 'item-'  # batch items get their own subdirectory of the job's scratch directory
+# Names yt-dlp gives files of an unfinished transfer, which never leave the scratch directory
+PARTIAL_NAME = re.compile(r'(\.part|\.ytdl|\.part-Frag\d+(\.part)?)$')
+TEMP_NAME = re.compile(r'(.+)\.temp\.(\w+)')
+
+STAGED_BYTES = registry.register(Counter(
+    'ytdlp_co2_staged_bytes_moved_total', 'Bytes moved from the scratch directory to the download volume'))
+
+
+def is_partial(path: Path) -> bool:
+    if PARTIAL_NAME.search(path.name):
+        return True
+    match = TEMP_NAME.fullmatch(path.name)
+    if match is None:
+        return False
+    # ffmpeg steps write X.temp.ext next to the X.ext or X.f<format>.<ext> files they work on,
+    # a lone "Clip.temp.mp4" is a title
+    stem, ext = match.groups()
+    return (path.parent / f'{stem}.{ext}').exists() or any(path.parent.glob(f'{glob.escape(stem)}.f*.*'))
+
+
+class Stager:
+    def __init__(self, scratch: Optional[Path], final: Path):
+        self.scratch = scratch
+        self.final = final
+        if scratch is not None:
+            scratch.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.scratch is not None
+
+    def job_dir(self, job_id: str, item: str = None) -> Path:
+        job_dir = self.scratch / job_id
+        if item is not None:
+            # Keyed by URL rather than position, so a resumed batch finds its items' partial files again
+            job_dir = job_dir / (ITEM_PREFIX + hashlib.sha1(item.encode()).hexdigest()[:12])
+        return job_dir
+
+    def template(self, template, job_id: str, item: str = None):
+        """The job's output template moved into its scratch directory, templates outside DOWNLOAD_DIR are left alone"""
+        if not self.enabled or not isinstance(template, str):
+            return template
+        try:
+            relative = Path(template).relative_to(self.final)
+        except ValueError:
+            return template
+        return str(self.job_dir(job_id, item) / relative)
+
+    def final_path(self, path: str, job_id: str, item: str = None) -> str:
+        """Where a file written to the scratch directory ends up"""
+        if not self.enabled:
+            return path
+        try:
+            return str(self.final / Path(path).relative_to(self.job_dir(job_id, item)))
+        except ValueError:
+            return path
+
+    def publish(self, job_id: str, item: str = None) -> List[str]:
+        """Move a job's finished files to the download volume, runs on the move pool"""
+        return self.publish_dir(job_id, self.job_dir(job_id, item))
+
+    def publish_dir(self, job_id: str, source: Path) -> List[str]:
+        moved = []
+        for path in sorted(source.rglob('*')):
+            relative = path.relative_to(source)
+            if not path.is_file() or is_partial(path):
+                continue
+            if source == self.scratch / job_id and relative.parts[0].startswith(ITEM_PREFIX):
+                # Batch items are published from their own directory
+                continue
+            target = self.final / relative
+            target.parent.mkdir(parents=True, exist_ok=True)
+            size = path.stat().st_size
+            # A rename when both directories share a filesystem, a copy otherwise
+            shutil.move(str(path), str(target))
+            STAGED_BYTES.inc(size)
+            moved.append(str(target))
+        self.prune(source)
+        if moved:
+            logger.info(f"Moved {len(moved)} files of {job_id} to {self.final}")
+        return moved
+
+    def prune(self, directory: Path):
+        """Remove empty directories left in scratch, up to the scratch root"""
+        for path in sorted((p for p in directory.rglob('*') if p.is_dir()), reverse=True):
+            if not any(path.iterdir()):
+                path.rmdir()
+        while directory != self.scratch and directory.is_dir() and not any(directory.iterdir()):
+            directory.rmdir()
+            directory = directory.parent
+
+    async def move(self, job_id: str, item: str = None) -> List[str]:
+        if not self.enabled:
+            return []
+        return await asyncio.get_event_loop().run_in_executor(move_executor, self.publish, job_id, item)
+
+    def finish(self, job_id: str):
+        """Publish the finished media a completed, failed or cancelled job left in scratch and drop its partial files"""
+        job_dir = self.job_dir(job_id)
+        sources = [path for path in job_dir.iterdir() if path.is_dir() and path.name.startswith(ITEM_PREFIX)]
+        for source in sources + [job_dir]:
+            try:
+                self.publish_dir(job_id, source)
+            except Exception as e:
+                logger.error(f"Could not move finished files of {job_id} out of {source}: {e}")
+        for path in job_dir.rglob('*'):
+            if path.is_file() and is_partial(path):
+                path.unlink(missing_ok=True)
+        self.prune(job_dir)
+        if job_dir.exists():
+            logger.warning(f"Files of {job_id} could not be moved and were left in {job_dir}")
+
+    def settle(self, job_id: str):
+        """Finish a job that ended for good on the move pool"""
+        if self.enabled and self.job_dir(job_id).exists():
+            move_executor.submit(self.finish, job_id)
+
+    def sweep(self, keep):
+        """Settle scratch directories of jobs the journal no longer knows, e.g. cancelled while the server was down"""
+        if not self.enabled:
+            return
+        for path in self.scratch.iterdir():
+            if path.is_dir() and path.name not in keep:
+                logger.info(f"Clearing orphaned scratch directory {path}")
+                self.settle(path.name)
+
+
+def configured_scratch() -> Optional[Path]:
+    scratch = os.environ.get('SCRATCH_DIR')
+    return Path(scratch) if scratch else None
@@ -0,0 +1,190 @@
+"""
+Channel/playlist subscriptions with incremental sync
+Keeps per-source state (last seen IDs and upload date watermark) so that
+periodic syncs only walk the playlist until they reach already known entries
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable
+
+import yt_dlp
+from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.utils import DateRange, ExistingVideoReached, date_from_str, make_archive_id
+
+from .executors import extraction_executor
+from .hosts import host_gate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYNC_INTERVAL = 6 * 60 * 60  # seconds between periodic syncs
+SCHEDULER_TICK = 60  # seconds between checks for due subscriptions
+SEEN_IDS_LIMIT = 1000  # newest archive IDs kept per source
+
+
+class EntryCollector(PostProcessor):
+    """Pre-process hook that records every playlist entry yt-dlp lets through"""
+
+    def __init__(self, watermark: Optional[str] = None):
+        super().__init__()
+        self.watermark = watermark
+        self.entries: List[Dict[str, Any]] = []
+
+    def run(self, info):
+        upload_date = info.get('upload_date')
+        # Flat entries of most extractors skip yt-dlp's own date filter
+        if self.watermark and upload_date and upload_date < self.watermark:
+            return [], info
+
+        extractor_key = info.get('extractor_key') or info.get('ie_key')
+        if info.get('id') and extractor_key:
+            self.entries.append({
+                'id': info['id'],
+                'archive_id': make_archive_id(extractor_key, info['id']),
+                'url': info.get('webpage_url') or info.get('url'),
+                'title': info.get('title'),
+                'upload_date': upload_date,
+            })
+        return [], info
+
+
+def fetch_new_entries(subscription: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Walk the source lazily and return entries newer than the stored state (newest first)"""
+    collector = EntryCollector(subscription.get('watermark'))
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+        'break_on_existing': True,
+        # yt-dlp accepts any set-like object in place of an archive file
+        'download_archive': set(subscription.get('seen_ids', [])),
+    }
+    if subscription.get('watermark'):
+        ydl_opts['daterange'] = DateRange(start=subscription['watermark'])
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.add_post_processor(collector, when='pre_process')
+        try:
+            ydl.extract_info(subscription['url'], download=False)
+        except ExistingVideoReached:
+            # Reached the first entry synced previously, nothing older is new
+            pass
+
+    return collector.entries
+
+
+class SubscriptionManager:
+    """Persistent subscription store plus the periodic sync loop"""
+
+    def __init__(self, state_file: Path, enqueue: Callable[[str, Optional[str], Dict[str, Any]], None]):
+        self.state_file = state_file
+        self.enqueue = enqueue
+        self.lock = threading.Lock()
+        self.syncing = set()
+        self.subscriptions: Dict[str, Dict[str, Any]] = {}
+        if state_file.exists():
+            try:
+                with open(state_file, 'r') as f:
+                    self.subscriptions = json.load(f)
+            except Exception as e:
+                logger.error(f"Could not load subscriptions from {state_file}: {e}")
+
+    def save(self):
+        tmp_file = self.state_file.with_suffix('.tmp')
+        with self.lock:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.subscriptions, f, indent=2)
+            tmp_file.replace(self.state_file)
+
+    def add(self, url: str, format_id: str = None, options: Dict[str, Any] = None,
+            interval: int = None, dateafter: str = None) -> Dict[str, Any]:
+        if dateafter:
+            # The watermark is compared with upload dates as a string, so relative dates like now-1week are resolved once
+            try:
+                dateafter = date_from_str(dateafter).strftime('%Y%m%d')
+            except ValueError:
+                raise ValueError(f"Invalid dateafter: {dateafter}, use YYYYMMDD or a relative date like now-1week") from None
+        subscription = {
+            'id': str(uuid.uuid4()),
+            'url': url,
+            'format_id': format_id,
+            'options': options or {},
+            'interval': interval or DEFAULT_SYNC_INTERVAL,
+            'seen_ids': [],
+            'watermark': dateafter,
+            'created': time.time(),
+            'last_sync': None,
+            'last_new': 0,
+            'last_error': None,
+        }
+        self.subscriptions[subscription['id']] = subscription
+        self.save()
+        return subscription
+
+    def remove(self, sub_id: str) -> bool:
+        if self.subscriptions.pop(sub_id, None) is None:
+            return False
+        self.save()
+        return True
+
+    def list_subscriptions(self) -> List[Dict[str, Any]]:
+        return [
+            {k: v for k, v in sub.items() if k != 'seen_ids'} | {'seen_count': len(sub['seen_ids'])}
+            for sub in self.subscriptions.values()
+        ]
+
+    def record_sync(self, subscription: Dict[str, Any], entries: List[Dict[str, Any]]):
+        """Fold newly seen entries into the per-source state"""
+        new_ids = [e['archive_id'] for e in entries]
+        subscription['seen_ids'] = (new_ids + subscription['seen_ids'])[:SEEN_IDS_LIMIT]
+        dates = [e['upload_date'] for e in entries if e.get('upload_date')]
+        if subscription.get('watermark'):
+            dates.append(subscription['watermark'])
+        subscription['watermark'] = max(dates) if dates else None
+        subscription['last_sync'] = time.time()
+        subscription['last_new'] = len(entries)
+        subscription['last_error'] = None
+        self.save()
+
+    async def sync(self, sub_id: str) -> int:
+        """Fetch new entries for one subscription and enqueue them, returns the number enqueued"""
+        subscription = self.subscriptions.get(sub_id)
+        if subscription is None or sub_id in self.syncing:
+            return 0
+
+        self.syncing.add(sub_id)
+        try:
+            async with host_gate.request(subscription['url']):
+                entries = await asyncio.get_event_loop().run_in_executor(extraction_executor, fetch_new_entries, subscription)
+        except Exception as e:
+            logger.error(f"Subscription sync failed for {subscription['url']}: {e}")
+            subscription['last_sync'] = time.time()
+            subscription['last_error'] = str(e)
+            self.save()
+            return 0
+        finally:
+            self.syncing.discard(sub_id)
+
+        # Enqueue oldest first so downloads follow upload order
+        for entry in reversed(entries):
+            if entry.get('url'):
+                self.enqueue(entry['url'], subscription['format_id'], subscription['options'])
+        self.record_sync(subscription, entries)
+        logger.info(f"Subscription {sub_id} synced: {len(entries)} new entries")
+        return len(entries)
+
+    async def run_forever(self):
+        """Periodically sync every subscription whose interval has elapsed"""
+        while True:
+            now = time.time()
+            for sub_id, subscription in list(self.subscriptions.items()):
+                last_sync = subscription.get('last_sync') or 0
+                if now - last_sync >= subscription['interval']:
+                    await self.sync(sub_id)
+            await asyncio.sleep(SCHEDULER_TICK)
@@ -0,0 +1,209 @@
+"""
+Per-job phase timing
+Each job records spans for extraction, format selection, transfer and every
+post-processor run, exportable as a timeline or as OpenTelemetry (OTLP) JSON
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+from yt_dlp.postprocessor.common import PostProcessor
+
+TRACE_HISTORY = 500  # finished and running jobs whose traces are kept
+
+
+class JobTrace:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.trace_id = secrets.token_hex(16)
+        self.started = time.time_ns()
+        self.spans: List[Dict[str, Any]] = []
+        self.open: Dict[Any, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def begin(self, name: str, key: Any = None, parent: Optional[Dict[str, Any]] = None, **attributes) -> Dict[str, Any]:
+        """Open a span, optionally registered under key so a hook can close it later"""
+        span = {
+            'name': name,
+            'span_id': secrets.token_hex(8),
+            'parent_id': parent['span_id'] if parent else None,
+            'start': time.time_ns(),
+            'end': None,
+            'attributes': attributes,
+        }
+        with self.lock:
+            self.spans.append(span)
+            if key is not None:
+                self.open[key] = span
+        return span
+
+    def end(self, span_or_key: Any, **attributes):
+        with self.lock:
+            span = span_or_key if isinstance(span_or_key, dict) else self.open.pop(span_or_key, None)
+            if span is None or span['end'] is not None:
+                return
+            span['end'] = time.time_ns()
+            span['attributes'].update(attributes)
+
+    def finish(self, span: Dict[str, Any], **attributes):
+        """End a span along with hook-driven children that never saw their closing event"""
+        with self.lock:
+            children = [key for key, child in self.open.items() if child['parent_id'] == span['span_id']]
+        for key in children:
+            self.end(key, interrupted=True)
+        self.end(span, **attributes)
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Dict[str, Any]] = None, **attributes):
+        span = self.begin(name, parent=parent, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            span['attributes']['error'] = str(e)
+            raise
+        finally:
+            self.finish(span)
+
+    def timeline(self) -> Dict[str, Any]:
+        """Spans relative to the job start plus total time per phase"""
+        now = time.time_ns()
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s['start'])
+        phases = {}
+        timeline = []
+        for span in spans:
+            duration_ms = ((span['end'] or now) - span['start']) / 1e6
+            phases[span['name']] = phases.get(span['name'], 0) + duration_ms
+            timeline.append({
+                'name': span['name'],
+                'span_id': span['span_id'],
+                'parent_id': span['parent_id'],
+                'offset_ms': (span['start'] - self.started) / 1e6,
+                'duration_ms': duration_ms,
+                'running': span['end'] is None,
+                'attributes': span['attributes'],
+            })
+        return {
+            'download_id': self.job_id,
+            'trace_id': self.trace_id,
+            'started': self.started / 1e9,
+            'phases_ms': phases,
+            'spans': timeline,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP/JSON export, loadable by OpenTelemetry-aware trace viewers"""
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {'key': key, 'value': {'boolValue': value}}
+            if isinstance(value, int):
+                return {'key': key, 'value': {'intValue': str(value)}}
+            if isinstance(value, float):
+                return {'key': key, 'value': {'doubleValue': value}}
+            return {'key': key, 'value': {'stringValue': str(value)}}
+
+        now = time.time_ns()
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [attribute('service.name', 'yt-dlp-co2')]},
+                'scopeSpans': [{
+                    'scope': {'name': 'yt-dlp-co2'},
+                    'spans': [{
+                        'traceId': self.trace_id,
+                        'spanId': span['span_id'],
+                        'parentSpanId': span['parent_id'] or '',
+                        'name': span['name'],
+                        'kind': 1,
+                        'startTimeUnixNano': str(span['start']),
+                        'endTimeUnixNano': str(span['end'] or now),
+                        'attributes': [attribute('download_id', self.job_id)] + [
+                            attribute(k, v) for k, v in span['attributes'].items() if v is not None
+                        ],
+                        'status': {'code': 2, 'message': span['attributes']['error']} if 'error' in span['attributes'] else {},
+                    } for span in spans],
+                }],
+            }],
+        }
+
+
+class PhaseMarker(PostProcessor):
+    """No-op post-processor used to observe when yt-dlp reaches a processing stage"""
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def run(self, info):
+        self.callback(info)
+        return [], info
+
+
+class TraceHooks:
+    """yt-dlp hooks that turn one YoutubeDL run into child spans of parent"""
+
+    def __init__(self, trace: JobTrace, parent: Dict[str, Any]):
+        self.trace = trace
+        self.parent = parent
+        trace.begin('extraction', key='extraction', parent=parent)
+
+    def attach(self, ydl):
+        ydl.add_post_processor(PhaseMarker(self.extracted), when='pre_process')
+        ydl.add_post_processor(PhaseMarker(self.format_selected), when='before_dl')
+        ydl.add_progress_hook(self.progress)
+        ydl.add_postprocessor_hook(self.postprocessor)
+
+    def extracted(self, info):
+        self.trace.end('extraction', extractor=info.get('extractor_key'))
+        self.trace.begin('format_selection', key='format_selection', parent=self.parent)
+
+    def format_selected(self, info):
+        self.trace.end('format_selection', format_id=info.get('format_id'))
+
+    def progress(self, d):
+        key = ('transfer', d.get('filename'))
+        if d['status'] == 'downloading' and key not in self.trace.open:
+            self.trace.begin('transfer', key=key, parent=self.parent, filename=d.get('filename'))
+        elif d['status'] == 'finished':
+            if key not in self.trace.open:
+                # Already complete on disk, no downloading events were emitted
+                self.trace.begin('transfer', key=key, parent=self.parent, filename=d.get('filename'))
+            self.trace.end(key, bytes=d.get('total_bytes') or d.get('downloaded_bytes'))
+        elif d['status'] == 'error':
+            self.trace.end(key, error='download error')
+
+    def postprocessor(self, d):
+        key = ('postprocess', d.get('postprocessor'))
+        if d.get('postprocessor') == PhaseMarker.pp_key():
+            return
+        if d['status'] == 'started':
+            self.trace.begin(f"postprocess:{d.get('postprocessor')}", key=key, parent=self.parent,
+                             postprocessor=d.get('postprocessor'))
+        elif d['status'] == 'finished':
+            self.trace.end(key)
+
+
+class TraceStore:
+    """Keeps the most recent job traces"""
+
+    def __init__(self, max_jobs: int = TRACE_HISTORY):
+        self.max_jobs = max_jobs
+        self.traces: OrderedDict = OrderedDict()
+
+    def create(self, job_id: str) -> JobTrace:
+        trace = JobTrace(job_id)
+        self.traces[job_id] = trace
+        while len(self.traces) > self.max_jobs:
+            self.traces.popitem(last=False)
+        return trace
+
+    def get(self, job_id: str) -> Optional[JobTrace]:
+        return self.traces.get(job_id)
+
+
+traces = TraceStore()
@@ -0,0 +1,87 @@
+"""
+Event loop lag watchdog
+A coroutine measures how late the loop wakes up, while a helper thread
+notices stalls as they happen and captures the stack of the code blocking
+the loop
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, Any, Optional
+
+from .metrics import registry, Histogram
+
+CHECK_INTERVAL = 0.1  # seconds between loop heartbeats
+LAG_THRESHOLD = 0.25  # lag in seconds that counts as the loop being blocked
+STALL_HISTORY = 50  # blocking stacks kept for the diagnostics endpoint
+
+LOOP_LAG = registry.register(Histogram(
+    'ytdlp_co2_event_loop_lag_seconds', 'Delay between a scheduled loop wakeup and when it ran',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)))
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = CHECK_INTERVAL, threshold: float = LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.current_stall: Optional[Dict[str, Any]] = None
+        self.stalls = deque(maxlen=STALL_HISTORY)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    async def run(self):
+        self.loop_thread_id = threading.get_ident()
+        threading.Thread(target=self.monitor, name='loop-watchdog', daemon=True).start()
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self.heartbeat - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+            stall, self.current_stall = self.current_stall, None
+            if stall is not None:
+                stall['lag'] = lag
+
+    def monitor(self):
+        """Runs in its own thread so it can look at the loop while the loop is stuck"""
+        while True:
+            time.sleep(self.interval)
+            heartbeat = self.heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for < self.threshold or (self.current_stall and self.current_stall['heartbeat'] == heartbeat):
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stall = {
+                'heartbeat': heartbeat,
+                'detected_at': time.time(),
+                'blocked_for': blocked_for,
+                'lag': None,
+                'stack': traceback.format_stack(frame),
+            }
+            self.current_stall = stall
+            self.stalls.append(stall)
+
+    def diagnostics(self) -> Dict[str, Any]:
+        with LOOP_LAG.lock:
+            series = LOOP_LAG.series.get((), {'counts': [0] * len(LOOP_LAG.buckets), 'sum': 0.0, 'count': 0})
+            counts = list(series['counts'])
+        return {
+            'threshold': self.threshold,
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+            'samples': series['count'],
+            'histogram': {str(bound): count for bound, count in zip(LOOP_LAG.buckets, counts)},
+            'stalls': [{k: v for k, v in stall.items() if k != 'heartbeat'} for stall in reversed(self.stalls)],
+        }
+
+
+watchdog = LoopWatchdog()
@@ -0,0 +1,301 @@
+"""
+WebSocket progress fan-out load test
+
+Starts bench/progress_server.py (the app plus simulated downloads) in a
+subprocess and opens many /ws/progress clients against it. A share of the
+clients are slow (they sleep after every message) or stalled (they never
+read, so their socket buffers fill up). Once every client is connected, the
+simulated downloads start emitting progress through WebSocketProgressHook.
+
+The report covers delivery latency percentiles and loss rate per client
+class, plus the server's CPU time, CPU utilisation and resident memory.
+
+    python bench/fanout.py --clients 2000 --downloads 200
+    python bench/fanout.py --clients 500 --slow-fraction 0.2 --stalled-fraction 0.1 --output run.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import websockets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from throughput import REPO_ROOT, free_port, percentile, peak_rss_mb, get_json  # noqa: E402
+
+CONNECT_CONCURRENCY = 100  # simultaneous WebSocket handshakes while ramping up
+LATENCY_SAMPLES = 200_000  # latencies kept per client class (reservoir sampled)
+SAMPLE_INTERVAL = 0.5  # seconds between server CPU/RSS samples
+FILENAME_PATTERN = re.compile(r'sim/(\d+)/(\d+)@([\d.]+)')
+
+
+class ClientStats:
+    """Aggregated delivery numbers for one class of clients"""
+
+    def __init__(self):
+        self.clients = 0
+        self.connected = 0
+        self.connect_failures = 0
+        self.disconnected = 0
+        self.messages = 0
+        self.delivered = 0
+        self.latencies: List[float] = []
+        self.latency_count = 0
+
+    def observe(self, latency: float):
+        self.latency_count += 1
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(latency)
+        else:
+            index = random.randrange(self.latency_count)
+            if index < LATENCY_SAMPLES:
+                self.latencies[index] = latency
+
+    def report(self, emitted: int) -> Dict[str, Any]:
+        expected = emitted * self.connected
+        return {
+            'clients': self.clients,
+            'connected': self.connected,
+            'connect_failures': self.connect_failures,
+            'disconnected_early': self.disconnected,
+            'messages': self.messages,
+            'delivered_events': self.delivered,
+            'loss_rate': 1 - self.delivered / expected if expected else None,
+            'latency_s': {
+                'p50': percentile(self.latencies, 50),
+                'p90': percentile(self.latencies, 90),
+                'p99': percentile(self.latencies, 99),
+                'max': max(self.latencies, default=None),
+            },
+        }
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User plus system CPU time of a process from /proc (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def current_rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def scrape_metrics(base_url: str) -> Dict[str, float]:
+    with urllib.request.urlopen(f'{base_url}/metrics') as response:
+        text = response.read().decode()
+    values = {}
+    for line in text.splitlines():
+        if line.startswith(('ytdlp_co2_progress_events', 'ytdlp_co2_broadcast_messages')):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def start_server(port: int, workdir: Path) -> subprocess.Popen:
+    env = dict(os.environ, DOWNLOAD_DIR=str(workdir / 'downloads'), STATE_DIR=str(workdir / 'state'))
+    (workdir / 'downloads').mkdir(parents=True, exist_ok=True)
+    (workdir / 'state').mkdir(parents=True, exist_ok=True)
+    process = subprocess.Popen(
+        [sys.executable, str(REPO_ROOT / 'bench' / 'progress_server.py'), '--port', str(port)],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        preexec_fn=raise_fd_limit)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            get_json(f'http://127.0.0.1:{port}/bench/simulate')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('Server did not start within 30s')
+
+
+async def run_clients(args, base_url: str, server_pid: int) -> Dict[str, Any]:
+    ws_url = base_url.replace('http://', 'ws://') + '/ws/progress'
+    stats = {kind: ClientStats() for kind in ('normal', 'slow', 'stalled')}
+    stop = asyncio.Event()
+    connect_slots = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    kinds = ['stalled'] * int(args.clients * args.stalled_fraction)
+    kinds += ['slow'] * int(args.clients * args.slow_fraction)
+    kinds += ['normal'] * (args.clients - len(kinds))
+    random.shuffle(kinds)
+
+    async def client(kind: str, ready: asyncio.Event):
+        client_stats = stats[kind]
+        client_stats.clients += 1
+        try:
+            async with connect_slots:
+                # A stalled client keeps at most one frame buffered, so TCP backpressure reaches the server
+                ws = await websockets.connect(ws_url, max_queue=1 if kind == 'stalled' else 16,
+                                              open_timeout=30, ping_interval=None)
+        except Exception:
+            client_stats.connect_failures += 1
+            ready.set()
+            return
+        client_stats.connected += 1
+        ready.set()
+        last_seq: Dict[str, int] = {}
+        try:
+            if kind == 'stalled':
+                await stop.wait()
+                return
+            while not stop.is_set():
+                try:
+                    message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
+                received = time.time()
+                client_stats.messages += 1
+                match = FILENAME_PATTERN.fullmatch(json.loads(message).get('filename', ''))
+                if match:
+                    download, seq, emitted_at = match.group(1), int(match.group(2)), float(match.group(3))
+                    if seq > last_seq.get(download, -1):
+                        last_seq[download] = seq
+                        client_stats.delivered += 1
+                    client_stats.observe(received - emitted_at)
+                if kind == 'slow':
+                    await asyncio.sleep(args.slow_delay)
+        except websockets.ConnectionClosed:
+            client_stats.disconnected += 1
+        finally:
+            await ws.close()
+
+    # Ramp up every client before the downloads start
+    ramp_started = time.monotonic()
+    readies = [asyncio.Event() for _ in kinds]
+    tasks = [asyncio.create_task(client(kind, ready)) for kind, ready in zip(kinds, readies)]
+    await asyncio.gather(*(ready.wait() for ready in readies))
+    ramp_s = time.monotonic() - ramp_started
+
+    cpu_before = process_cpu_seconds(server_pid)
+    client_cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+    samples = []
+    started = time.monotonic()
+    simulate = (f'{base_url}/bench/simulate?downloads={args.downloads}&events={args.events}'
+                f'&interval={args.interval}')
+    await asyncio.to_thread(urllib.request.urlopen, urllib.request.Request(simulate, method='POST'))
+
+    last_cpu, last_sample = cpu_before, started
+    while time.monotonic() - started < args.timeout:
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        now, cpu = time.monotonic(), process_cpu_seconds(server_pid)
+        if cpu is not None and last_cpu is not None:
+            samples.append({'cpu_percent': 100 * (cpu - last_cpu) / (now - last_sample),
+                            'rss_mb': current_rss_mb(server_pid)})
+        last_cpu, last_sample = cpu, now
+        status = await asyncio.to_thread(get_json, f'{base_url}/bench/simulate')
+        if status['running'] == 0:
+            break
+    # Let queued messages drain before counting losses
+    await asyncio.sleep(args.drain)
+    elapsed = time.monotonic() - started
+    status = await asyncio.to_thread(get_json, f'{base_url}/bench/simulate')
+    metrics = await asyncio.to_thread(scrape_metrics, base_url)
+    cpu_after = process_cpu_seconds(server_pid)
+    client_cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    cpu_seconds = cpu_after - cpu_before if cpu_after is not None and cpu_before is not None else None
+    emitted = status['emitted']
+    return {
+        'ramp_up_s': ramp_s,
+        'elapsed_s': elapsed,
+        'emitted_events': emitted,
+        'unfinished_downloads': status['running'],
+        'clients': {kind: client_stats.report(emitted) for kind, client_stats in stats.items()},
+        'server': {
+            'cpu_seconds': cpu_seconds,
+            'cpu_percent_avg': 100 * cpu_seconds / elapsed if cpu_seconds is not None else None,
+            'cpu_percent_max': max((s['cpu_percent'] for s in samples), default=None),
+            'rss_mb_max': max((s['rss_mb'] for s in samples if s['rss_mb']), default=None),
+            'peak_rss_mb': peak_rss_mb(server_pid),
+            'metrics': metrics,
+        },
+        # A saturated client process inflates latency, so its own CPU use is reported as well
+        'client_cpu_seconds': (client_cpu_after.ru_utime + client_cpu_after.ru_stime
+                               - client_cpu_before.ru_utime - client_cpu_before.ru_stime),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=1000, help='WebSocket clients to open')
+    parser.add_argument('--slow-fraction', type=float, default=0.1, help='share of clients that read slowly')
+    parser.add_argument('--slow-delay', type=float, default=0.05, help='seconds a slow client sleeps per message')
+    parser.add_argument('--stalled-fraction', type=float, default=0.05, help='share of clients that never read')
+    parser.add_argument('--downloads', type=int, default=200, help='simulated downloads')
+    parser.add_argument('--events', type=int, default=100, help='progress events per download')
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between progress events')
+    parser.add_argument('--drain', type=float, default=2, help='seconds to wait for delivery after the last event')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for the simulation')
+    parser.add_argument('--output', type=Path, help='JSON results file (default bench/results/fanout-<time>.json)')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix='co2-bench-') as tmp:
+        server = start_server(port, Path(tmp))
+        try:
+            results = asyncio.run(run_clients(args, f'http://127.0.0.1:{port}', server.pid))
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    report = {
+        'benchmark': 'fanout',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'websockets': websockets.__version__,
+            'git_rev': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                      capture_output=True, text=True).stdout.strip() or None,
+        },
+        'results': results,
+    }
+    output = args.output or REPO_ROOT / 'bench' / 'results' / f"fanout-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(json.dumps(results, indent=2))
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
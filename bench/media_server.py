@@ -0,0 +1,144 @@
+"""
+Local HTTP server serving synthetic progressive and HLS media
+Lets the benchmarks drive yt-dlp's generic extractor without network access
+
+    /progressive/<name>.mp4?size=BYTES
+    /hls/<name>.m3u8?segments=N&segment_size=BYTES
+    /hls/<name>/<n>.ts?size=BYTES
+
+Every URL also accepts rate=BYTES_PER_SECOND to emulate a slow link.
+With max_connections set, transfers beyond that many at once get a 429,
+like a CDN that starts throttling.
+"""
+
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+PATTERN = bytes(range(256)) * 256  # 64 KiB of filler written repeatedly
+TS_PACKET = b'\x47' + bytes(187)  # MPEG-TS sync byte followed by padding
+DEFAULT_SIZE = 4 * 1024 * 1024
+DEFAULT_SEGMENTS = 8
+DEFAULT_SEGMENT_SIZE = 512 * 1024
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, head=False):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        rate = int(query.get('rate', 0))
+
+        if re.fullmatch(r'/progressive/[\w.-]+\.mp4', url.path):
+            self.send_body('video/mp4', int(query.get('size', DEFAULT_SIZE)), PATTERN, rate, head)
+        elif match := re.fullmatch(r'/hls/([\w.-]+)\.m3u8', url.path):
+            segments = int(query.get('segments', DEFAULT_SEGMENTS))
+            segment_size = int(query.get('segment_size', DEFAULT_SEGMENT_SIZE))
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+            for n in range(segments):
+                lines += ['#EXTINF:4.0,', f'{match.group(1)}/{n}.ts?size={segment_size}&rate={rate}']
+            lines.append('#EXT-X-ENDLIST')
+            playlist = ('\n'.join(lines) + '\n').encode()
+            self.send_body('application/vnd.apple.mpegurl', len(playlist), playlist, 0, head)
+        elif re.fullmatch(r'/hls/[\w.-]+/\d+\.ts', url.path):
+            self.send_body('video/mp2t', int(query.get('size', DEFAULT_SEGMENT_SIZE)), TS_PACKET * 349, rate, head)
+        else:
+            self.send_error(404)
+
+    def send_body(self, content_type: str, size: int, pattern: bytes, rate: int, head: bool):
+        server = self.server
+        with server.lock:
+            throttled = server.max_connections and server.active >= server.max_connections
+            if not throttled and not head:
+                server.active += 1
+        if throttled:
+            self.send_error(429)
+            return
+        try:
+            self.send_range(content_type, size, pattern, rate, head)
+        finally:
+            if not head:
+                with server.lock:
+                    server.active -= 1
+
+    def send_range(self, content_type: str, size: int, pattern: bytes, rate: int, head: bool):
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        if match := re.fullmatch(r'bytes=(\d+)-(\d*)', range_header or ''):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if head:
+            return
+
+        remaining = end - start + 1
+        offset = start % len(pattern)
+        started = time.monotonic()
+        sent = 0
+        try:
+            while remaining > 0:
+                chunk = (pattern[offset:] + pattern)[:min(remaining, 64 * 1024)]
+                self.wfile.write(chunk)
+                offset = (offset + len(chunk)) % len(pattern)
+                remaining -= len(chunk)
+                sent += len(chunk)
+                if rate:
+                    ahead = sent / rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MediaServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, max_connections: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), MediaHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.active = 0
+        self.httpd.max_connections = max_connections
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def progressive_url(self, name: str, size: int = DEFAULT_SIZE, rate: int = 0) -> str:
+        return f'{self.base_url}/progressive/{name}.mp4?size={size}&rate={rate}'
+
+    def hls_url(self, name: str, segments: int = DEFAULT_SEGMENTS, segment_size: int = DEFAULT_SEGMENT_SIZE, rate: int = 0) -> str:
+        return f'{self.base_url}/hls/{name}.m3u8?segments={segments}&segment_size={segment_size}&rate={rate}'
+
+    def start(self) -> 'MediaServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    server = MediaServer(port=8765).start()
+    print(f'Serving synthetic media on {server.base_url}')
+    server.thread.join()
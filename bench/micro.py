@@ -0,0 +1,245 @@
+"""
+Micro-benchmarks for hot request and progress paths
+
+Times convert_to_ydl_opts on a full options form, get_options_by_category,
+get_quality_string, the /formats table construction (filter, rank and rows)
+and WebSocketProgressHook.__call__ over a progress stream. The fixtures are
+synthesised to match real payloads: a YouTube-sized info dict with a few
+hundred formats, every option filled in, and a per-chunk progress stream.
+Pass --info-json to use a recorded .info.json instead.
+
+Results can be saved as a baseline. Later runs are compared against it and
+the script exits non-zero when a benchmark is slower than the baseline by
+more than --threshold.
+
+    python bench/micro.py --save-baseline
+    python bench/micro.py --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Callable
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = REPO_ROOT / 'bench' / 'micro-baseline.json'
+MIN_RUN_TIME = 0.2  # seconds each repeat should take, loops are scaled to reach it
+
+# app.main mounts static/ relative to the working directory and reads its state paths from the environment
+os.chdir(REPO_ROOT)
+sys.path.insert(0, str(REPO_ROOT))
+os.environ.setdefault('DOWNLOAD_DIR', tempfile.mkdtemp(prefix='co2-micro-'))
+os.environ.setdefault('STATE_DIR', tempfile.mkdtemp(prefix='co2-micro-'))
+
+from app import main  # noqa: E402
+from app.formats import FormatTable  # noqa: E402
+from app.options import YT_DLP_OPTIONS, OptionType, convert_to_ydl_opts, get_options_by_category  # noqa: E402
+
+
+def synthetic_info(video_formats: int = 240, audio_formats: int = 24) -> Dict[str, Any]:
+    """Info dict shaped like a long YouTube video with storyboard, video-only and audio-only formats"""
+    heights = [144, 240, 360, 480, 720, 1080, 1440, 2160]
+    vcodecs = ['avc1.64001F', 'vp09.00.40.08', 'av01.0.08M.08', 'vp9']
+    formats = []
+    for n in range(4):
+        formats.append({'format_id': f'sb{n}', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none',
+                        'width': 160, 'height': 90, 'fps': 0.5, 'format_note': 'storyboard', 'protocol': 'mhtml'})
+    for n in range(audio_formats):
+        abr = [48, 64, 128, 160][n % 4]
+        formats.append({
+            'format_id': f'{139 + n}-{n}', 'ext': 'm4a' if n % 2 else 'webm',
+            'vcodec': 'none', 'acodec': 'mp4a.40.2' if n % 2 else 'opus',
+            'abr': abr, 'tbr': abr, 'asr': 48000, 'audio_channels': 2,
+            'filesize': abr * 125 * 3600 if n % 3 else None, 'filesize_approx': abr * 125 * 3600,
+            'language': ['en', 'de', 'fr', 'es', 'ja', 'pt'][n % 6], 'protocol': 'https',
+            'url': f'https://rr1---sn-example.googlevideo.com/videoplayback?itag={139 + n}&n={n}',
+            'http_headers': {'User-Agent': 'Mozilla/5.0', 'Accept': '*/*'},
+            'format_note': 'medium', 'quality': n % 4,
+        })
+    for n in range(video_formats):
+        height = heights[n % len(heights)]
+        vcodec = vcodecs[(n // len(heights)) % len(vcodecs)]
+        fps = 60 if n % 3 == 0 else 30
+        tbr = height * fps / 20 + n % 7
+        protocol = 'm3u8_native' if n % 5 == 0 else 'https'
+        formats.append({
+            'format_id': f'{160 + n}' + ('-hls' if protocol == 'm3u8_native' else ''),
+            'ext': 'mp4' if vcodec.startswith('avc') else 'webm',
+            'vcodec': vcodec, 'acodec': 'none', 'width': height * 16 // 9, 'height': height,
+            'fps': fps, 'tbr': tbr, 'vbr': tbr, 'dynamic_range': 'HDR10' if n % 11 == 0 else 'SDR',
+            'filesize': int(tbr * 125 * 3600) if n % 4 else None, 'filesize_approx': int(tbr * 125 * 3600),
+            'protocol': protocol, 'container': 'mp4_dash',
+            'url': f'https://rr1---sn-example.googlevideo.com/videoplayback?itag={160 + n}&n={n}',
+            'fragments': [{'url': f'sq/{i}', 'duration': 5.0} for i in range(20)] if protocol == 'm3u8_native' else None,
+            'http_headers': {'User-Agent': 'Mozilla/5.0', 'Accept': '*/*'},
+            'format_note': f'{height}p{fps if fps > 30 else ""}', 'quality': n % len(heights),
+        })
+    return {
+        'id': 'dQw4w9WgXcQ', 'title': 'Synthetic benchmark video', 'duration': 3600,
+        'extractor': 'youtube', 'extractor_key': 'Youtube', 'webpage_url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+        'formats': formats,
+        'thumbnails': [{'url': f'https://i.ytimg.com/vi/x/{n}.jpg', 'preference': n} for n in range(40)],
+        'subtitles': {lang: [{'ext': ext, 'url': f'https://example.com/{lang}.{ext}'} for ext in ('vtt', 'srv3', 'json3')]
+                      for lang in ('en', 'de', 'fr', 'es', 'ja')},
+    }
+
+
+def full_options_form() -> Dict[str, str]:
+    """Every known option filled in with a string value, as an HTML form would submit it"""
+    form = {}
+    for key, option in YT_DLP_OPTIONS.items():
+        if option['type'] == OptionType.BOOLEAN:
+            form[key] = 'true'
+        elif option['type'] == OptionType.NUMBER:
+            form[key] = '3'
+        elif option['type'] == OptionType.SELECT:
+            form[key] = str(next((value for value in option.get('options', []) if value is not None), 'auto'))
+        elif option['type'] == OptionType.MULTI_SELECT:
+            form[key] = 'en, de, fr, ja'
+        else:
+            form[key] = f'{key}-value'
+    form['url'] = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    return form
+
+
+def progress_stream(events: int = 2000, total_bytes: int = 500 * 1024 * 1024) -> List[Dict[str, Any]]:
+    """Progress dicts for one video and one audio file, ending with their finished events"""
+    stream = []
+    for filename, share in (('video.f299.mp4', 0.85), ('video.f140.m4a', 0.15)):
+        size = int(total_bytes * share)
+        count = int(events * share)
+        for n in range(count):
+            downloaded = size * (n + 1) // count
+            stream.append({
+                'status': 'downloading', 'filename': filename, 'tmpfilename': filename + '.part',
+                'downloaded_bytes': downloaded, 'total_bytes': size, 'speed': 12.5e6, 'eta': (size - downloaded) / 12.5e6,
+                'elapsed': n * 0.04, '_percent_str': f'{100 * downloaded / size:5.1f}%',
+                '_speed_str': '11.92MiB/s', '_eta_str': f'{(size - downloaded) / 12.5e6:.0f}s',
+                'info_dict': {'id': 'dQw4w9WgXcQ', 'format_id': filename.split('.')[1][1:]},
+            })
+        stream.append({'status': 'finished', 'filename': filename, 'downloaded_bytes': size, 'total_bytes': size,
+                       'elapsed': count * 0.04, 'info_dict': {'id': 'dQw4w9WgXcQ'}})
+    return stream
+
+
+def build_benchmarks(info: Dict[str, Any]) -> Dict[str, Callable[[], Any]]:
+    form = full_options_form()
+    formats = info.get('formats') or []
+    stream = progress_stream()
+
+    def format_list():
+        table = FormatTable(formats)
+        indices = table.filter(vcodec='avc1,vp9', max_height=1080)
+        return table.rows(table.sort(indices, None)[:20])
+
+    def quality_strings():
+        return [main.get_quality_string(f) for f in formats]
+
+    def progress_hook():
+        hook = main.WebSocketProgressHook('bench')
+        for d in stream:
+            hook(d)
+        main.active_downloads.pop('bench', None)
+
+    return {
+        'convert_to_ydl_opts': lambda: convert_to_ydl_opts(form),
+        'get_options_by_category': get_options_by_category,
+        'get_quality_string': quality_strings,
+        'format_list': format_list,
+        'progress_hook': progress_hook,
+    }
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Seconds per call, scaling loops so each repeat runs for at least MIN_RUN_TIME"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_RUN_TIME:
+            break
+        loops *= 2 if elapsed else 10
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            function()
+        timings.append((time.perf_counter() - started) / loops)
+    timings.sort()
+    return {'loops': loops, 'best_s': timings[0], 'median_s': timings[len(timings) // 2]}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run (default all)')
+    parser.add_argument('--repeat', type=int, default=7, help='timed repeats per benchmark')
+    parser.add_argument('--info-json', type=Path, help='recorded .info.json to use as the formats fixture')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='write these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline (0.2 = 20%%)')
+    parser.add_argument('--output', type=Path, help='also write results JSON to this file')
+    args = parser.parse_args()
+
+    info = json.loads(args.info_json.read_text()) if args.info_json else synthetic_info()
+    benchmarks = build_benchmarks(info)
+    selected = args.benchmarks or list(benchmarks)
+    unknown = [name for name in selected if name not in benchmarks]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)} (choose from {', '.join(benchmarks)})")
+
+    baseline = json.loads(args.baseline.read_text())['results'] if args.baseline.exists() else {}
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<26}{'best':>12}{'median':>12}{'baseline':>12}{'change':>9}")
+    for name in selected:
+        result = measure(benchmarks[name], args.repeat)
+        results[name] = result
+        line = f"{name:<26}{result['best_s'] * 1e6:>10.1f}us{result['median_s'] * 1e6:>10.1f}us"
+        if name in baseline:
+            # Compare best times, they are the least sensitive to background noise
+            change = result['best_s'] / baseline[name]['best_s'] - 1
+            result['change'] = change
+            line += f"{baseline[name]['best_s'] * 1e6:>10.1f}us{change:>+8.1%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+
+    import yt_dlp
+    report = {
+        'benchmark': 'micro',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'fixture': str(args.info_json) if args.info_json else 'synthetic',
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'yt_dlp': yt_dlp.version.__version__,
+            'git_rev': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                      capture_output=True, text=True).stdout.strip() or None,
+        },
+        'results': results,
+    }
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        if baseline:
+            # Keep entries for benchmarks that were not part of this run
+            report['results'] = {**baseline, **results}
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f'Baseline written to {args.baseline}')
+    elif regressions:
+        print(f"Slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,79 @@
+"""
+App server with simulated downloads for the WebSocket fan-out benchmark
+
+Runs app.main under uvicorn and adds POST /bench/simulate, which starts one
+thread per simulated download. Each thread feeds yt-dlp style progress dicts
+into WebSocketProgressHook at a steady rate, so events travel the same path
+as real downloads. The emit time and sequence number are carried in the
+filename field ("sim/<n>/<seq>@<unix time>") so clients can measure delivery
+latency and loss.
+
+    python bench/progress_server.py --port 8000
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+import uvicorn
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+from app.main import app, WebSocketProgressHook  # noqa: E402
+
+simulation = {'threads': [], 'emitted': 0}
+emitted_lock = threading.Lock()
+
+
+def simulate_download(index: int, events: int, interval: float, total_bytes: int):
+    hook = WebSocketProgressHook(f'sim-{index:05d}')
+    # Stagger start times so downloads do not tick in lockstep
+    time.sleep(random.uniform(0, interval))
+    for seq in range(events):
+        downloaded = total_bytes * (seq + 1) // events
+        status = 'finished' if seq == events - 1 else 'downloading'
+        hook({
+            'status': status,
+            'filename': f'sim/{index}/{seq}@{time.time():.6f}',
+            'downloaded_bytes': downloaded,
+            'total_bytes': total_bytes,
+            'speed': total_bytes / events / interval,
+            '_percent_str': f'{100 * downloaded / total_bytes:5.1f}%',
+            '_speed_str': f'{total_bytes / events / interval / 1024 / 1024:.2f}MiB/s',
+            '_eta_str': f'{(events - seq - 1) * interval:.0f}s',
+        })
+        with emitted_lock:
+            simulation['emitted'] += 1
+        time.sleep(interval * random.uniform(0.8, 1.2))
+
+
+@app.post('/bench/simulate')
+async def start_simulation(downloads: int = 100, events: int = 100, interval: float = 0.1,
+                           total_bytes: int = 100 * 1024 * 1024):
+    offset = len(simulation['threads'])
+    for n in range(downloads):
+        thread = threading.Thread(target=simulate_download, args=(offset + n, events, interval, total_bytes), daemon=True)
+        thread.start()
+        simulation['threads'].append(thread)
+    return {'started': downloads}
+
+
+@app.get('/bench/simulate')
+async def simulation_status():
+    return {
+        'downloads': len(simulation['threads']),
+        'running': sum(1 for thread in simulation['threads'] if thread.is_alive()),
+        'emitted': simulation['emitted'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--backlog', type=int, default=4096)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, backlog=args.backlog, log_level='warning')
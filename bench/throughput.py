@@ -0,0 +1,248 @@
+"""
+End-to-end offline throughput benchmark
+
+Starts the app in a uvicorn subprocess against temporary download/state
+directories and a local synthetic media server. It then submits /download
+and batch jobs at a fixed rate and reports jobs/s, aggregate MB/s, time to
+first progress event, p50/p99 completion latency and the server's peak RSS.
+
+    python bench/throughput.py --jobs 50 --rate 10 --mode mixed
+    python bench/throughput.py --jobs 20 --batches 4 --batch-size 25 --output run.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import websockets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from media_server import MediaServer  # noqa: E402
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FINAL_STATUSES = {'completed', 'error', 'skipped'}
+POLL_INTERVAL = 0.2
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """High-water RSS of a process from /proc (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def post_form(url: str, fields: Dict[str, str], files: Dict[str, bytes] = None) -> str:
+    boundary = uuid.uuid4().hex
+    body = b''
+    for name, value in fields.items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for name, content in (files or {}).items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}.txt"\r\n'
+                 f'Content-Type: text/plain\r\n\r\n').encode() + content + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(request) as response:
+        return response.read().decode()
+
+
+def get_json(url: str) -> Any:
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def start_app(port: int, workdir: Path) -> subprocess.Popen:
+    env = dict(os.environ, DOWNLOAD_DIR=str(workdir / 'downloads'), STATE_DIR=str(workdir / 'state'))
+    (workdir / 'downloads').mkdir(parents=True, exist_ok=True)
+    (workdir / 'state').mkdir(parents=True, exist_ok=True)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            get_json(f'http://127.0.0.1:{port}/downloads')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('App did not start within 30s')
+
+
+def media_url(media: MediaServer, args, name: str, index: int) -> str:
+    use_hls = args.mode == 'hls' or (args.mode == 'mixed' and index % 2)
+    if use_hls:
+        segment_size = max(1, int(args.size_mb * 1024 * 1024 / args.segments))
+        return media.hls_url(name, segments=args.segments, segment_size=segment_size, rate=args.link_rate)
+    return media.progressive_url(name, size=int(args.size_mb * 1024 * 1024), rate=args.link_rate)
+
+
+async def run_load(args, base_url: str, media: MediaServer) -> Dict[str, Any]:
+    jobs: Dict[str, Dict[str, Any]] = {}
+    ws_url = base_url.replace('http://', 'ws://') + '/ws/progress'
+
+    async def listen():
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            async for message in ws:
+                data = json.loads(message)
+                job = jobs.get(data.get('download_id'))
+                if job is not None and job['first_progress'] is None:
+                    job['first_progress'] = time.monotonic()
+
+    # Batches are spread evenly between the single submissions
+    submissions = ['single'] * args.jobs
+    for n in range(args.batches):
+        submissions.insert(n + (n + 1) * args.jobs // (args.batches + 1), 'batch')
+
+    async def submit(index: int, kind: str):
+        run_id = uuid.uuid4().hex[:8]
+        fields = {'fixup': 'never'}
+        files = None
+        if kind == 'batch':
+            urls = [media_url(media, args, f'b{run_id}_{n}', n) for n in range(args.batch_size)]
+            files = {'batchfile': '\n'.join(urls).encode()}
+        else:
+            fields['url'] = media_url(media, args, f's{run_id}', index)
+        submitted = time.monotonic()
+        html = await asyncio.to_thread(post_form, f'{base_url}/download', fields, files)
+        match = re.search(r'id="download-([0-9a-f-]+)"', html)
+        if not match:
+            print(f'Submission failed: {html[:200]}', file=sys.stderr)
+            return
+        jobs[match.group(1)] = {
+            'kind': kind,
+            'items': args.batch_size if kind == 'batch' else 1,
+            'submitted': submitted,
+            'first_progress': None,
+            'finished': None,
+            'status': None,
+        }
+
+    listener = asyncio.create_task(listen())
+    await asyncio.sleep(0.5)
+    started = time.monotonic()
+    submitters = []
+    for index, kind in enumerate(submissions):
+        await asyncio.sleep(max(0, started + index / args.rate - time.monotonic()))
+        submitters.append(asyncio.create_task(submit(index, kind)))
+    await asyncio.gather(*submitters)
+
+    deadline = started + args.timeout
+    while time.monotonic() < deadline:
+        downloads = await asyncio.to_thread(get_json, f'{base_url}/downloads')
+        now = time.monotonic()
+        for download_id, job in jobs.items():
+            status = downloads.get(download_id, {}).get('status')
+            if job['finished'] is None and status in FINAL_STATUSES:
+                job['finished'], job['status'] = now, status
+        if all(job['finished'] is not None for job in jobs.values()):
+            break
+        await asyncio.sleep(POLL_INTERVAL)
+    listener.cancel()
+
+    finished = [job for job in jobs.values() if job['finished'] is not None]
+    elapsed = max((job['finished'] for job in finished), default=time.monotonic()) - started
+    latencies = [job['finished'] - job['submitted'] for job in finished]
+    first_progress = [job['first_progress'] - job['submitted'] for job in jobs.values() if job['first_progress']]
+    items_done = sum(job['items'] for job in finished if job['status'] == 'completed')
+    return {
+        'submitted_jobs': len(jobs),
+        'finished_jobs': len(finished),
+        'failed_jobs': sum(1 for job in finished if job['status'] == 'error'),
+        'timed_out_jobs': len(jobs) - len(finished),
+        'completed_items': items_done,
+        'elapsed_s': elapsed,
+        'jobs_per_s': len(finished) / elapsed if elapsed else None,
+        'items_per_s': items_done / elapsed if elapsed else None,
+        'time_to_first_progress_s': {'p50': percentile(first_progress, 50), 'p99': percentile(first_progress, 99)},
+        'completion_latency_s': {'p50': percentile(latencies, 50), 'p99': percentile(latencies, 99)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=20, help='single /download submissions')
+    parser.add_argument('--batches', type=int, default=0, help='batch file submissions')
+    parser.add_argument('--batch-size', type=int, default=10, help='URLs per batch file')
+    parser.add_argument('--rate', type=float, default=5, help='submissions per second')
+    parser.add_argument('--mode', choices=['progressive', 'hls', 'mixed'], default='progressive')
+    parser.add_argument('--size-mb', type=float, default=4, help='media size per URL')
+    parser.add_argument('--segments', type=int, default=8, help='HLS segments per URL')
+    parser.add_argument('--link-rate', type=int, default=0, help='per-connection bytes/s served, 0 for unlimited')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for all jobs')
+    parser.add_argument('--output', type=Path, help='JSON results file (default bench/results/throughput-<time>.json)')
+    args = parser.parse_args()
+
+    media = MediaServer().start()
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix='co2-bench-') as tmp:
+        workdir = Path(tmp)
+        app_process = start_app(port, workdir)
+        try:
+            results = asyncio.run(run_load(args, f'http://127.0.0.1:{port}', media))
+            results['peak_rss_mb'] = peak_rss_mb(app_process.pid)
+            downloaded = sum(f.stat().st_size for f in (workdir / 'downloads').rglob('*') if f.is_file())
+            results['downloaded_mb'] = downloaded / 1024 / 1024
+            results['mb_per_s'] = results['downloaded_mb'] / results['elapsed_s'] if results['elapsed_s'] else None
+        finally:
+            app_process.terminate()
+            try:
+                app_process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                app_process.kill()
+            media.stop()
+
+    import yt_dlp
+    report = {
+        'benchmark': 'throughput',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'yt_dlp': yt_dlp.version.__version__,
+            'git_rev': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                      capture_output=True, text=True).stdout.strip() or None,
+        },
+        'results': results,
+    }
+    output = args.output or REPO_ROOT / 'bench' / 'results' / f"throughput-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(json.dumps(results, indent=2))
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
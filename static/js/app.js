@@ -376,6 +376,8 @@ document.addEventListener('DOMContentLoaded', function() {
                         </div>
                     `;
                 }
+            } else if (data.status === 'paused' || data.status === 'cancelled') {
+                progressElement.innerHTML = `<span>${data.status === 'paused' ? 'Paused' : 'Cancelled'}, partial download kept</span>`;
             } else if (data.status === 'error') {
                 const downloadDiv = document.getElementById(`download-${data.download_id}`);
                 if (downloadDiv) {